@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from erdbeermet.simulation import simulate
-from erdbeermet.recognition import recognize
+from erdbeermet.recognition import recognize, is_r_matrix
 
 
 counter = 1
@@ -12,10 +12,11 @@ while True:
     
     scenario = simulate(6)
     
-    recognition_tree = recognize(scenario.D, print_info=False,
-                                 first_candidate_only=True)
-    
-    if recognition_tree.valid_ways == 0:
+    if not is_r_matrix(scenario.D, first_candidate_only=True):
+        
+        recognition_tree, _ = recognize(scenario.D, print_info=False,
+                                        first_candidate_only=True)
+        
         print('\n')
         scenario.print_history()
         
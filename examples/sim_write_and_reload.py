@@ -2,6 +2,7 @@
 
 
 from erdbeermet.simulation import simulate, load
+import numpy as np
 import os
 
 result_dir = 'example_histories'
@@ -40,3 +41,11 @@ scenario_reloaded2 = load(os.path.join(result_dir, 'testfile_history_circular'))
 
 print(scenario_reloaded2.D)
 print(scenario_reloaded2.get_circular_order())
+
+
+# ------------------ prefix matrices ------------------
+
+# the last prefix matrix is the distance matrix of the scenario
+for prefix_matrix in scenario.iter_prefix_matrices():
+    pass
+assert np.array_equal(prefix_matrix, scenario.D)
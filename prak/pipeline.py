@@ -1,9 +1,13 @@
 from typing import Union
 from erdbeermet.simulation import simulate
-from erdbeermet.recognition import recognize
+from erdbeermet.recognition import recognize, is_r_matrix
+from erdbeermet.tools.Archive import append_scenario
+from erdbeermet.visualize.RenderQueue import RenderQueue
 from time import time
 from itertools import permutations
+from contextlib import nullcontext
 import os
+import numpy as np
 
 
 def pipeline(size:Union[int,list], iterations:int=1, first_four_simulation:list=[0,1,2,3], circular:bool=False, clocklike:bool=False, first_candidate_only:bool=True, block_leaves:int=0, choose_smallest_spike:bool=False, generate_hist_files:bool = False, pdf_error:bool=False, print_failed:bool=False, print_info:bool=False):
@@ -48,9 +52,19 @@ def pipeline(size:Union[int,list], iterations:int=1, first_four_simulation:list=
     # filename var which corresponds to starting time
     fn = time()
     if generate_hist_files:
-        os.makedirs(os.path.dirname(f'prak/sim_outputs/{subfolder}/{wp}_{fn}_hists/'), exist_ok=True)
+        os.makedirs(f'prak/sim_outputs/{subfolder}', exist_ok=True)
+        # all failed scenarios go into one archive (see erdbeermet.tools.Archive)
+        archive = f'prak/sim_outputs/{subfolder}/{wp}_{fn}_hists.erdb'
 
-    with open(f'prak/sim_outputs/{subfolder}/{wp}_{fn}.txt', 'w') as f:
+    summary = f'prak/sim_outputs/{subfolder}/{wp}_{fn}.txt'
+
+    def render(rec_tree, dest):
+        rec_tree.save(dest + '.tree', matrices=False)
+        renderer.submit_tree(dest + '.tree', dest + '.pdf')
+
+    # the PDFs are rendered by worker processes, the pipeline only enqueues them
+    # (the queue waits for the remaining PDFs when the block is left)
+    with open(summary, 'w') as f, (RenderQueue() if pdf_error else nullcontext()) as renderer:
         # write chosen parameters to file
         f.write(f'=====================================================\n')
         f.write(f'size:                  {size}\n')
@@ -97,10 +111,14 @@ def pipeline(size:Union[int,list], iterations:int=1, first_four_simulation:list=
                 if block_leaves in [3,4]:
                     perms = permutations(range(s), block_leaves)
                     for B in perms:
-                        rec_tree, circle = recognize(scenario.D, B, choose_smallest_spike, first_candidate_only, print_info)
-                        if rec_tree.root.valid_ways > 0:
+                        # decide first, build the tree only for the chosen B
+                        # (recognize() repeats the random tie-breaks of WP4 from the same state)
+                        random_state = np.random.get_state()
+                        if is_r_matrix(scenario.D, B, choose_smallest_spike, first_candidate_only):
                             # print("valid permutation found")
                             break
+                    np.random.set_state(random_state)
+                    rec_tree, circle = recognize(scenario.D, B, choose_smallest_spike, first_candidate_only, print_info)
                 # WP4
                 elif choose_smallest_spike:
                     rec_tree, circle = recognize(scenario.D, B, choose_smallest_spike, first_candidate_only, print_info)
@@ -109,7 +127,7 @@ def pipeline(size:Union[int,list], iterations:int=1, first_four_simulation:list=
                     rec_tree, circle = recognize(scenario.D, B, choose_smallest_spike, first_candidate_only, print_info)
 
                 if circle and pdf_error:
-                    rec_tree.visualize(save_as=dest + ".pdf", popup=False)
+                    render(rec_tree, f"prak/sim_outputs/{subfolder}/{wp}_{fn}_s{s}_circle_{i}")
 
                 # recognized as valid R-map
                 rec_as_r_map = rec_tree.root.valid_ways > 0
@@ -117,9 +135,10 @@ def pipeline(size:Union[int,list], iterations:int=1, first_four_simulation:list=
                 # reconstruction failed: print matrix, save tree, show box-graphs
                 if not rec_as_r_map:
                     fails += 1
-                    # save hist file 
+                    # save history, matrix and outcome to the archive
                     if generate_hist_files:
-                        scenario.write_history(os.path.join(f'prak/sim_outputs/{subfolder}/{wp}_{fn}_hists/', f'error_{fails}'))   
+                        append_scenario(archive, scenario.history, scenario.D,
+                                        {'size': s, 'iteration': i, 'fail': fails, 'circle': bool(circle)})
 
                     if circle:
                         circles += 1
@@ -131,7 +150,7 @@ def pipeline(size:Union[int,list], iterations:int=1, first_four_simulation:list=
                         f.write('\n')
                         dest = f"prak/sim_outputs/{subfolder}/{wp}_{fn}_s{s}_{fails}"
                         if pdf_error:
-                            rec_tree.visualize(save_as=dest + ".pdf", popup=False)
+                            render(rec_tree, dest)
                     continue
 
                 # get the first valid combination of 4 leaves
@@ -179,6 +198,14 @@ def pipeline(size:Union[int,list], iterations:int=1, first_four_simulation:list=
             f.write(f'circles:             {circles}\n')
             f.write('=====================================================\n')
             f.write('\n')
+
+    # report PDFs that could not be rendered
+    if renderer is not None and renderer.failed:
+        with open(summary, 'a') as f:
+            f.write(f'failed PDFs:         {len(renderer.failed)} of {renderer.submitted}\n')
+            for save_as, exception in renderer.failed:
+                f.write(f'  {save_as}: {exception!r}\n')
+        print(f'{len(renderer.failed)} PDFs could not be rendered, see {summary}')
                 
 # SET PARAMETERS HERE  
 # int or list - max number of elements to be simulated (matrix-size)
@@ -219,6 +246,8 @@ PRINT_INFO = False
 
 
 # RUN PIPELINE HERE
-pipeline(SIZE, ITERATIONS, FIRST_FOUR_SIMULATION, 
-    CIRCULAR, CLOCKLIKE, FIRST_CANDIDATE_ONLY, BLOCK_LEAVES, 
-    CHOOSE_SMALLEST_SPIKE, GENERATE_HIST_FILES, PDF_ERROR, PRINT_FAILED, PRINT_INFO)
\ No newline at end of file
+# (guarded, since the worker processes of the PDF rendering may import this file)
+if __name__ == '__main__':
+    pipeline(SIZE, ITERATIONS, FIRST_FOUR_SIMULATION, 
+        CIRCULAR, CLOCKLIKE, FIRST_CANDIDATE_ONLY, BLOCK_LEAVES, 
+        CHOOSE_SMALLEST_SPIKE, GENERATE_HIST_FILES, PDF_ERROR, PRINT_FAILED, PRINT_INFO)
\ No newline at end of file
@@ -1,23 +1,51 @@
 # -*- coding: utf-8 -*-
 
-from itertools import combinations, permutations
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import hashlib
+import heapq
+import multiprocessing
+import os
+
 import numpy as np
 from numpy.core.numeric import isclose
 
+from erdbeermet.tools.Condensed import matrix_block, matrix_size, to_matrix
 from erdbeermet.tools.Tree import Tree, TreeNode
 
 
 __author__ = 'David Schaller'
 
 
+def _min_plus_rows(D, i0, i1, j0, block_size):
+    """Minima of D[i, k] + D[k, j] over all k for rows i0 <= i < i1 and
+    columns j >= j0, computed in blocks of at most block_size**3 sums.
+    D may be a square matrix or a condensed vector."""
+    
+    N = matrix_size(D)
+    minimum = np.full((i1-i0, N-j0), np.inf)
+    
+    for k0 in range(0, N, block_size):
+        k1 = min(k0 + block_size, N)
+        for c0 in range(j0, N, block_size):
+            c1 = min(c0 + block_size, N)
+            sums = (matrix_block(D, i0, i1, k0, k1)[:, :, None] +
+                    matrix_block(D, k0, k1, c0, c1)[None, :, :])
+            np.minimum(minimum[:, c0-j0:c1-j0], sums.min(axis=1),
+                       out=minimum[:, c0-j0:c1-j0])
+    
+    return minimum
+
+
 def is_pseudometric(D, rtol=1e-05, atol=1e-08, print_info=False, V=None,
-                    return_info=False):
+                    return_info=False, block_size=128):
     """Check whether a given distance matrix is a pseudometric.
     
     Parameters
     ----------
-    D : 2-dimensional numpy array
-        Distance matrix
+    D : numpy array
+        Distance matrix, or its condensed vector (see tools.Condensed), in
+        which case the diagonal and the symmetry need not be checked.
     rtol : float, optional
         Relative tolerance for equality. The default is 1e-05.
     atol : float, optional
@@ -30,6 +58,11 @@ def is_pseudometric(D, rtol=1e-05, atol=1e-08, print_info=False, V=None,
     return_info : bool, optional
         If True, return an info string as a second return value. The default
         is False.
+    block_size : int, optional
+        The triangle inequality is checked as a min-plus product on blocks of
+        block_size rows, intermediate items, and columns, i.e., at most
+        block_size**3 sums are held in memory at a time; the other checks
+        process about block_size**2 entries at a time. The default is 128.
     
     Return
     ------
@@ -37,42 +70,165 @@ def is_pseudometric(D, rtol=1e-05, atol=1e-08, print_info=False, V=None,
         True if D is a pseudometric and optionally an info string.
     """
     
-    N = D.shape[0]
+    N = matrix_size(D)
+    
+    # the entries are checked in chunks of rows (or of the condensed vector)
+    # so that D can also be a large memory-mapped array
+    chunk = max(1, block_size**2 // max(1, N)) if D.ndim == 2 else block_size**2
     
     # check whether all entries are non-negative
-    if not np.all(np.logical_or(np.isclose(D, 0.0, rtol=rtol, atol=atol),
-                                D > 0.0)):
-        return False if not return_info else (False, 'negative distances')
-    
-    # check whether all diagonal entries are zero
-    if np.any(np.diagonal(D)):
-        return False if not return_info else (False, 'non-zero diagonal')
-    
-    # check whether the matrix is symmetric
-    if not np.allclose(D, D.T, rtol=rtol, atol=atol):
-        return False if not return_info else (False, 'not symmetric')
-    
-    # check the triangle inequality
-    for i in range(N-1):
-        for j in range(i+1, N):
-            minimum = np.min(D[i, :] + D[:, j])
-            if minimum < D[i, j] and not np.isclose(minimum, D[i, j],
-                                                    rtol=rtol, atol=atol):
-                if print_info or return_info:
-                    argmin = np.argmin(D[i, :] + D[:, j])
-                    if not V:
-                        info = f'triangle inequality violation: D[{i},'\
-                               f'{j}]={D[i,j]} > {minimum} over {argmin}'
-                    else:
-                        info = f'triangle inequality violation: D[v{V[i]},'\
-                               f'v{V[j]}]={D[i,j]} > {minimum} over v{V[argmin]}'
-                        if print_info:
-                            print(info)
-                return False if not return_info else (False, info)
+    for r0 in range(0, D.shape[0], chunk):
+        entries = D[r0:r0+chunk]
+        if not np.all(np.logical_or(np.isclose(entries, 0.0,
+                                               rtol=rtol, atol=atol),
+                                    entries > 0.0)):
+            return False if not return_info else (False, 'negative distances')
+    
+    if D.ndim == 2:
+        
+        # check whether all diagonal entries are zero
+        if np.any(np.diagonal(D)):
+            return False if not return_info else (False, 'non-zero diagonal')
+        
+        # check whether the matrix is symmetric
+        for r0 in range(0, N, chunk):
+            if not np.allclose(D[r0:r0+chunk], D[:, r0:r0+chunk].T,
+                               rtol=rtol, atol=atol):
+                return False if not return_info else (False, 'not symmetric')
+    
+    # check the triangle inequality, i.e. whether D[i,j] exceeds (and is not
+    # close to) the minimum of D[i,:] + D[:,j] for some i < j, in blocks of
+    # rows so that the first violation in (i, j) order is found first
+    for i0 in range(0, N-1, block_size):
+        i1 = min(i0 + block_size, N-1)
+        minimum = _min_plus_rows(D, i0, i1, i0+1, block_size)
+        current = matrix_block(D, i0, i1, i0+1, N)
+        violated = np.logical_and(
+            minimum < current,
+            np.abs(minimum - current) > atol + rtol * np.abs(current))
+        violated = np.triu(violated)        # only pairs with j > i
+        
+        if not np.any(violated):
+            continue
+        
+        # the violating entry is reported from the scanned block
+        i, j = np.argwhere(violated)[0]
+        distance, minimum = current[i, j], minimum[i, j]
+        i, j = i0 + i, i0 + 1 + j
+        
+        if print_info or return_info:
+            argmin = np.argmin(matrix_block(D, i, i+1, 0, N)[0, :] +
+                               matrix_block(D, 0, N, j, j+1)[:, 0])
+            info = _triangle_violation_info(distance, i, j, minimum, argmin,
+                                            V, print_info)
+        return False if not return_info else (False, info)
             
     return True if not return_info else (True, 'passed')
 
 
+def _triangle_violation_info(distance, i, j, minimum, argmin, V, print_info):
+    
+    if not V:
+        info = f'triangle inequality violation: D[{i},'\
+               f'{j}]={distance} > {minimum} over {argmin}'
+    else:
+        info = f'triangle inequality violation: D[v{V[i]},'\
+               f'v{V[j]}]={distance} > {minimum} over v{V[argmin]}'
+        if print_info:
+            print(info)
+    
+    return info
+
+
+def is_pseudometric_after_update(D, indices, rtol=1e-05, atol=1e-08,
+                                 print_info=False, V=None, return_info=False):
+    """Check whether a distance matrix is still a pseudometric after an update.
+    
+    It is assumed that D restricted to all items except those in 'indices' is
+    a pseudometric, e.g., because D was obtained from a pseudometric by
+    removing items and changing only the rows and columns in 'indices' (as in
+    an R-step). Only the entries and triangles involving these rows are
+    checked, which takes O(n^2) instead of O(n^3) time.
+    
+    Parameters
+    ----------
+    D : 2-dimensional numpy array
+        Distance matrix
+    indices : list of int
+        Indices of the rows and columns that were changed.
+    rtol : float, optional
+        Relative tolerance for equality. The default is 1e-05.
+    atol : float, optional
+        Absolute tolerance for equality. The default is 1e-08.
+    print_info : bool, optional
+        If True, print the encountered violation of the triangle inequality
+        if any.
+    V : list, optional
+        List of items (used for info output).
+    return_info : bool, optional
+        If True, return an info string as a second return value. The default
+        is False.
+    
+    Return
+    ------
+    bool or tuple of bool and str
+        True if D is a pseudometric and optionally an info string.
+    
+    See also
+    --------
+    is_pseudometric
+    """
+    
+    for p in indices:
+        
+        row, col = D[p, :], D[:, p]
+        
+        # check whether all entries are non-negative
+        if not np.all(np.logical_or(np.isclose(row, 0.0, rtol=rtol, atol=atol),
+                                    row > 0.0)):
+            return False if not return_info else (False, 'negative distances')
+        
+        # check whether the diagonal entry is zero
+        if D[p, p]:
+            return False if not return_info else (False, 'non-zero diagonal')
+        
+        # check whether the row and column coincide
+        if not np.allclose(row, col, rtol=rtol, atol=atol):
+            return False if not return_info else (False, 'not symmetric')
+    
+    for p in indices:
+        
+        # (1) triangles with an edge p--j, i.e. D[p,j] <= D[p,k] + D[k,j]
+        sums = D[p, :, None] + D
+        minimum = np.min(sums, axis=0)
+        violated = np.logical_and(
+            minimum < D[p, :],
+            np.abs(minimum - D[p, :]) > atol + rtol * np.abs(D[p, :]))
+        
+        if np.any(violated):
+            j = np.argmax(violated)
+            if print_info or return_info:
+                info = _triangle_violation_info(D[p, j], p, j, minimum[j],
+                                                np.argmin(sums[:, j]), V,
+                                                print_info)
+            return False if not return_info else (False, info)
+        
+        # (2) triangles with p in the middle, i.e. D[i,j] <= D[i,p] + D[p,j]
+        sums = D[:, p, None] + D[None, p, :]
+        violated = np.logical_and(
+            sums < D,
+            np.abs(sums - D) > atol + rtol * np.abs(D))
+        
+        if np.any(violated):
+            i, j = np.argwhere(violated)[0]
+            if print_info or return_info:
+                info = _triangle_violation_info(D[i, j], i, j, sums[i, j], p,
+                                                V, print_info)
+            return False if not return_info else (False, info)
+    
+    return True if not return_info else (True, 'passed')
+
+
 def distance_sums_matrix(D, x, y, z, u):
     
     xy_zu = D[x,y] + D[z,u]
@@ -102,12 +258,12 @@ def _recognize4_parent_xy(D, x, y, z, u):
     left = D[x,y] * (D[x,y] + 2 * D[z,u] - D[x,z] - D[y,u] - D[x,u] - D[y,z])
     right = (D[x,z] - D[y,z]) * (D[y,u] - D[x,u])
     
-    return np.isclose(left, right) or left < right
+    return np.logical_or(np.isclose(left, right), left < right)
 
 def _recognize4_xy_zu(D, x, y, z, u):
     
-    return (_recognize4_parent_xy(D, x, y, z, u) or 
-            _recognize4_parent_xy(D, z, u, x, y))
+    return np.logical_or(_recognize4_parent_xy(D, x, y, z, u),
+                         _recognize4_parent_xy(D, z, u, x, y))
     
 
 def recognize4_new(D, x, y, z, u):
@@ -192,72 +348,178 @@ def _compute_alpha(V, D, x, y, z, u, v):
     else:
         return np.nan
 
+
+def _alpha_tensor(D, y):
+    """Alphas of all R-steps (x, y: z) for a fixed y and all witness pairs.
+    
+    D is a stack of distance matrices of shape (k, n, n). The entry
+    [b, x, z, u, v] equals _compute_alpha(V, D[b], x, y, z, u, v) for all
+    x < y (positions in D), evaluated in the same order of operations. The
+    second return value masks the pairs whose denominator is close to zero,
+    i.e., for which _compute_alpha would return NaN.
+    """
     
-def _find_candidates(D, V, print_info):
+    D_T = D.transpose(0, 2, 1)
+    col_y = D[:, :, y]
     
-    candidates = []
-    n = len(V)
+    # E[b, a, u, v] = (D[u,a] + D[v,y]) - (D[v,a] + D[u,y])
+    E = ((D_T[:, :, :, None] + col_y[:, None, None, :]) -
+         (D_T[:, :, None, :] + col_y[:, None, :, None]))
     
-    if print_info: print(f'-----> n = {n}, V = {V} ---> Candidates')
+    numerator = E[:, None, :, :, :]
+    denominator = E[:, :y, None, :, :]
     
-    for x, y, z in permutations(V, 3):
+    defined = np.abs(denominator) > 1e-08     # not np.isclose(denom, 0.0)
+    alpha = numerator / denominator
+    
+    return alpha, np.broadcast_to(defined, alpha.shape)
+
+
+def _candidate_arrays(D, V):
+    """Vectorized candidate search on a stack of distance matrices.
+    
+    Parameters
+    ----------
+    D : 3-dimensional numpy array
+        Stack of distance matrices of shape (k, n, n).
+    V : 2-dimensional numpy array
+        Items corresponding to the rows of the matrices, shape (k, n).
+    
+    Returns
+    -------
+    tuple of numpy arrays
+        Arrays of shape (k, n, n, n) indexed by the positions of (x, y, z):
+        whether the triple is a candidate with consistent alpha, whether no
+        alpha is defined for it, whether all alphas are defined, the alpha
+        (snapped to 0 or 1 if close), and the position of the witness u.
+    """
+    
+    k, n = D.shape[0], D.shape[1]
+    pos = np.arange(n)
+    
+    # per triple (x, y, z): reference alpha, whether any/all alphas are
+    # defined and consistent, and the position of the witness u
+    ref_alpha = np.zeros((k, n, n, n))
+    any_defined = np.zeros((k, n, n, n), dtype=bool)
+    all_defined = np.zeros((k, n, n, n), dtype=bool)
+    consistent = np.zeros((k, n, n, n), dtype=bool)
+    witness = np.zeros((k, n, n, n), dtype=int)
+    
+    # pairs u < v in the order of combinations(V, 2), flattened to u * n + v
+    pairs = pos[:, None] < pos[None, :]
+    u_nonzero = np.broadcast_to((V != 0)[:, :, None], (k, n, n))
+    u_nonzero = u_nonzero.reshape(k, 1, 1, n * n)
+    
+    for y in range(1, n):
         
-        # considering x < y suffices
-        if x > y:
-            continue
+        with np.errstate(divide='ignore', invalid='ignore'):
+            alpha, defined = _alpha_tensor(D, y)
         
-        alpha = np.zeros(( (n-3) * (n-4) // 2 ,))
+        # usable witness pairs: u < v and u, v not in (x, y, z)
+        xs, zs = pos[:y, None, None], pos[None, :, None]
+        u_ok = (pos[None, None, :] != xs) & (pos[None, None, :] != zs)
+        u_ok &= (pos != y)[None, None, :]
+        usable = pairs[None, None, :, :] & u_ok[..., :, None] & \
+                 u_ok[..., None, :]
         
-        pos = 0
-        u_witness = None
-        for u, v in combinations(V, 2):
-            if u in  (x, y, z) or v in (x, y, z):
-                continue
-            
-            alpha[pos] = _compute_alpha(V, D, x, y, z, u, v)
-            
-            if not u_witness and not np.isnan(alpha[pos]):
-                u_witness = u
-                
-            pos += 1
+        alpha = alpha.reshape(k, y, n, n * n)
+        usable = usable.reshape(1, y, n, n * n)
+        valid = usable & defined.reshape(k, y, n, n * n)
         
-        nan_mask = np.isnan(alpha)
+        # reference alpha is the first defined alpha in pair order
+        first = np.argmax(valid, axis=3)
+        ref = np.take_along_axis(alpha, first[..., None], axis=3)
         
-        if not np.any(nan_mask) and np.allclose(alpha, alpha[0]):
-            
-            alpha[0] = _close_to_equal(alpha[0])
-            
-            if alpha[0] >= 0.0 and alpha[0] <= 1.0:
-                candidates.append((x, y, z, u_witness, alpha[0]))
-                deltas = _compute_deltas(V, D, alpha[0], x, y, z, u_witness)
-                
-                if print_info: 
-                    print(f'({x}, {y}: {z}) alpha={alpha}', end='   ')
-                    print('δx = {:.3f}, δy = {:.3f}, '\
-                          'δz = {:.3f}, dxy = {:.3f}'.format(deltas[2],
-                                                             deltas[3],
-                                                             deltas[0],
-                                                             deltas[1]))
-            
-        elif not np.all(nan_mask):
-            
-            ref_alpha = alpha[ np.argmin(nan_mask) ]
-            masked_alpha = np.ma.array(alpha, mask=nan_mask)
-            
-            if np.ma.allclose(masked_alpha, ref_alpha, masked_equal=True):
-                ref_alpha = _close_to_equal(ref_alpha)
-                if ref_alpha >= 0.0 and ref_alpha <= 1.0:
-                    candidates.append((x, y, z, u_witness, ref_alpha))
-                    
-        else:
+        # same comparison as np.allclose / np.ma.allclose with the defaults
+        with np.errstate(invalid='ignore'):
+            close = (np.abs(alpha - ref) <= 1e-08 + 1e-05 * np.abs(ref))
+        
+        # witness: first u with a defined alpha, where u = 0 is only kept if
+        # no other u has a defined alpha
+        valid_nonzero = valid & u_nonzero
+        first_nonzero = np.argmax(valid_nonzero, axis=3)
+        
+        ref_alpha[:, :y, y, :] = ref[..., 0]
+        any_defined[:, :y, y, :] = np.any(valid, axis=3)
+        all_defined[:, :y, y, :] = ~np.any(usable & ~valid, axis=3)
+        consistent[:, :y, y, :] = np.all(close | ~valid, axis=3)
+        witness[:, :y, y, :] = np.where(np.any(valid_nonzero, axis=3),
+                                        first_nonzero, first) // n
+    
+    # snap alphas that are close to 0 or 1 (cf. _close_to_equal)
+    snapped = np.where(np.abs(ref_alpha) <= 1e-08, 0.0, ref_alpha)
+    snapped = np.where(np.abs(snapped - 1.0) <= 1e-08 + 1e-05, 1.0, snapped)
+    
+    triples = (pos[:, None, None] < pos[None, :, None]) & \
+              (pos[None, None, :] != pos[:, None, None]) & \
+              (pos[None, None, :] != pos[None, :, None])
+    
+    accepted = (triples & any_defined & consistent &
+                (snapped >= 0.0) & (snapped <= 1.0))
+    undefined = triples & ~any_defined
+    
+    return accepted, undefined, all_defined, snapped, witness
+
+
+def _candidate_list(V, accepted, undefined, snapped, witness):
+    """Candidate list of a single matrix from the arrays of _candidate_arrays.
+    """
+    
+    n = len(V)
+    candidates = []
+    
+    for x, y, z in np.argwhere(accepted | undefined):
+        
+        if undefined[x, y, z]:
             # choose an arbitrary alpha (e.g. 0.5) and witness u (?)
-            ref_alpha, u_witness = 0.5, None
-            for u in V:
-                if u not in (x, y, z):
-                    u_witness = u
-                    break
-            candidates.append((x, y, z, u_witness, ref_alpha))
-            
+            u = min(i for i in range(n) if i not in (x, y, z))
+            candidates.append((V[x], V[y], V[z], V[u], 0.5))
+        else:
+            candidates.append((V[x], V[y], V[z], V[witness[x, y, z]],
+                               snapped[x, y, z]))
+    
+    return candidates
+
+
+def _find_candidates(D, V, print_info):
+    """Candidate R-steps (x, y: z)alpha with witness u on the item list V.
+    
+    All triples and witness pairs are evaluated at once (one alpha tensor per
+    choice of y). A triple (x, y, z) with x < y is a candidate if all alphas
+    that are defined coincide (up to the usual tolerances) with a value in
+    [0, 1]. If no alpha is defined for the triple, it is a candidate with
+    alpha = 0.5 and the first remaining item as witness.
+    
+    Returns
+    -------
+    list of tuples
+        Tuples (x, y, z, u_witness, alpha) in the order of the permutations of
+        V.
+    """
+    
+    n = len(V)
+    
+    if print_info: print(f'-----> n = {n}, V = {V} ---> Candidates')
+    
+    accepted, undefined, all_defined, snapped, witness = _candidate_arrays(
+        D[None, :, :], np.asarray(V)[None, :])
+    
+    candidates = _candidate_list(V, accepted[0], undefined[0], snapped[0],
+                                 witness[0])
+    
+    if print_info:
+        for x, y, z, u_witness, alpha in candidates:
+            i, j, l = V.index(x), V.index(y), V.index(z)
+            if undefined[0, i, j, l] or not all_defined[0, i, j, l]:
+                continue
+            deltas = _compute_deltas(V, D, alpha, x, y, z, u_witness)
+            print(f'({x}, {y}: {z}) alpha={alpha}', end='   ')
+            print('δx = {:.3f}, δy = {:.3f}, '\
+                  'δz = {:.3f}, dxy = {:.3f}'.format(deltas[2],
+                                                     deltas[3],
+                                                     deltas[0],
+                                                     deltas[1]))
+    
     return candidates
 
 
@@ -304,208 +566,1698 @@ def _matrix_without_index(D, index):
     if index < 0 or index >= n:
         raise IndexError(f"Index {index} is out of range!")
     
-    D_new = np.zeros((n-1, n-1))
+    return np.delete(np.delete(D, index, axis=0), index, axis=1)
+
+
+class _SharedMatrix:
+    """Distance matrix of the current node of a depth-first recognition.
     
-    indices = [i for i in range(n) if i != index]
+    The remaining items V occupy the leading block of a single buffer in their
+    original order. Applying an R-step removes z by shifting the subsequent
+    rows and columns and updates the rows of x and y in place; the overwritten
+    rows and columns are recorded in an undo log, so that the step can be
+    reverted when the search backtracks. Each step thus allocates O(n) memory.
     
-    for i in range(n-1):
-        for j in range(n-1):
-            D_new[i, j] = D[indices[i], indices[j]]
+    Attributes
+    ----------
+    V : list
+        List of the remaining items.
+    """
     
-    return D_new
+    def __init__(self, D, V):
+        
+        self._buffer = np.array(D, dtype=float)
+        self.V = list(V)
+        self._undo_log = []
+        
+    
+    @property
+    def D(self):
+        """View of the distance matrix on the remaining items."""
+        
+        n = len(self.V)
+        return self._buffer[:n, :n]
+    
+    
+    def apply(self, x, y, z, delta_x, delta_y):
+        """Remove z and update x and y according to an R-step."""
+        
+        buffer, n = self._buffer, len(self.V)
+        p = self.V.index(z)
+        z_row, z_col = buffer[p, :n].copy(), buffer[:n, p].copy()
+        
+        for i in range(p, n-1):
+            buffer[i, :n] = buffer[i+1, :n]
+        for j in range(p, n-1):
+            buffer[:n-1, j] = buffer[:n-1, j+1]
+        del self.V[p]
+        
+        D, changed = self.D, []
+        for item, delta in ((x, delta_x), (y, delta_y)):
+            if delta:
+                i = self.V.index(item)
+                changed.append((i, D[i, :].copy(), D[:, i].copy()))
+        
+        _update_matrix(self.V, D, x, y, delta_x, delta_y)
+        self._undo_log.append((p, z, z_row, z_col, changed))
+        
+        
+    def undo(self):
+        """Revert the last R-step."""
+        
+        p, z, z_row, z_col, changed = self._undo_log.pop()
+        
+        D = self.D
+        for i, row, col in changed:
+            D[:, i] = col
+            D[i, :] = row
+        
+        self.V.insert(p, z)
+        buffer, n = self._buffer, len(self.V)
+        for j in range(n-1, p, -1):
+            buffer[:n-1, j] = buffer[:n-1, j-1]
+        for i in range(n-1, p, -1):
+            buffer[i, :n] = buffer[i-1, :n]
+        buffer[p, :n] = z_row
+        buffer[:n, p] = z_col
 
 
-def _finalize_tree(recognition_tree):
+class TranspositionTable:
+    """Memo of recognition subproblems that have been solved before.
+    
+    Different orders of R-steps often lead to the same remaining items V with
+    (numerically) the same reduced matrix. The table maps a fingerprint of
+    (V, D) to the number of valid ways and the failure info of the subtree
+    below such a node, so that the subtree does not have to be searched again.
+    The fingerprint is a hash of V and of the entries of D rounded to
+    'decimals' decimal places, i.e., two matrices share a key if and only if
+    their rounded entries are equal. There is no tolerance comparison: two
+    matrices that are equal within the tolerances of the recognition but
+    whose entries lie on different sides of a rounding boundary get
+    different keys, so the table can miss such a hit (the subproblem is then
+    simply searched again). The fingerprint also includes the settings of the
+    recognition (B, choose_smallest_spike, first_candidate_only), which
+    recognize() sets with set_settings(), so a table can be shared by
+    recognitions with different settings. The least recently used entries
+    are evicted once the table holds 'max_entries' entries.
+    
+    Attributes
+    ----------
+    max_entries : int
+        Maximal number of stored subproblems.
+    decimals : int
+        Number of decimal places considered in the fingerprint.
+    hits : int
+        Number of lookups of a stored subproblem.
+    misses : int
+        Number of lookups of a subproblem that was not stored.
+    evictions : int
+        Number of subproblems removed to respect max_entries.
+    """
     
-    def _sort_children(v):
-        v.children.sort(key=lambda c: c.R_step)
-        for c in v.children:
-            _sort_children(c)
+    def __init__(self, max_entries=100000, decimals=8):
+        
+        self.max_entries = max_entries
+        self.decimals = decimals
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        self._entries = OrderedDict()
+        self._settings = b''
+        
     
-    for v in recognition_tree.postorder():
-        if v.valid_ways and v.parent:
-            v.parent.valid_ways += v.valid_ways
-            
-    recognition_tree.valid_ways = recognition_tree.root.valid_ways
-    recognition_tree.successes = recognition_tree.root.valid_ways
-            
-    _sort_children(recognition_tree.root)
+    def __len__(self):
+        
+        return len(self._entries)
     
     
-def recognize(D, B=None, choose_smallest_spike=False, first_candidate_only=False, print_info=False):
-    """Recognition of type R matrices.
+    def set_settings(self, B, choose_smallest_spike, first_candidate_only):
+        """Settings of the recognition to which the following keys refer."""
+        
+        B = None if B is None else sorted(int(b) for b in B)
+        self._settings = repr((B, bool(choose_smallest_spike),
+                               bool(first_candidate_only))).encode('ascii')
     
-    Parameters
-    ----------
-    D : 2-dimensional numpy array
-        A distance matrix.
-    leaf_identifiers : list
-        a list of leaves, that must not be chosen as z
-    first_candidate_only : bool, optional
-        If True, only consider the first found candidate for a merge event.
-        The default is False.
-    print_info : bool, True
-        If True, print the recognition history. The default is False.
     
-    Returns
-    -------
-    Tree
-        The recognition tree.
+    def fingerprint(self, V, D):
+        """Key of the subproblem on items V with distance matrix D."""
+        
+        rounded = np.round(D[np.triu_indices(len(V), k=1)], self.decimals)
+        
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self._settings)
+        h.update(np.asarray(V, dtype=np.int64).tobytes())
+        # adding 0.0 turns -0.0 into 0.0
+        h.update((rounded + 0.0).tobytes())
+        
+        return h.digest()
     
-    See also
-    --------
-    tools.Tree
-    """
     
-    n = D.shape[0]
-    V = [i for i in range(n)]
+    def lookup(self, key):
+        """Stored (valid_ways, info) for the key, or None."""
+        
+        entry = self._entries.get(key)
+        
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        
+        return entry
+    
+    
+    def store(self, key, valid_ways, info):
+        
+        self._entries[key] = (valid_ways, info)
+        self._entries.move_to_end(key)
+        
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
 
-    circle = False
+
+class SearchStrategy:
+    """Order in which the nodes of the recognition tree are expanded.
     
-    recognition_tree = Tree(TreeNode(n, V, D=D))
-    stack = []
+    The nodes waiting for expansion are kept in a priority queue, and the node
+    with the smallest priority is expanded first. Nodes with equal priority
+    are expanded in last-in-first-out order, i.e., the base class (with
+    constant priority) corresponds to the depth-first search of recognize().
+    Subclasses override priority().
     
-    # trivial failure if not a pseudometric
-    if not is_pseudometric(D):
-        if print_info: print('no pseudometric')
-        recognition_tree.root.info = 'no pseudometric'
+    Attributes
+    ----------
+    name : str
+        Name of the strategy.
+    """
     
-    # every pseudometric is additve and thus also an R matrix
-    elif n <= 3:
-        if print_info: print(print(f'SUCCESS on {V}'))
-        recognition_tree.root.valid_ways = 1
+    name = 'dfs'
     
-    # otherwise start the recognition algorithm
-    else:
-        stack.append(recognition_tree.root)
+    def priority(self, node, deltas):
+        """Priority of a valid child node.
+        
+        Parameters
+        ----------
+        node : TreeNode
+            The node, its R-step (x, y: z)alpha is node.R_step.
+        deltas : tuple
+            delta_z, d_xy, delta_x, and delta_y of the R-step.
+        
+        Returns
+        -------
+        comparable
+        """
+        
+        return 0
+
+
+class SmallestSpikeFirst(SearchStrategy):
+    """Deepest nodes first, among them the smallest spike delta_z of the
+    removed item z."""
     
-   
-    while stack:
+    name = 'smallest_spike'
+    
+    def priority(self, node, deltas):
         
-        parent = stack.pop()
-        V, D = parent.V, parent.D
-        n = len(V)
+        return (node.n, deltas[0])
+
+
+class AlphaBoundaryFirst(SearchStrategy):
+    """Deepest nodes first, among them the alpha closest to 0 or 1."""
+    
+    name = 'alpha_boundary'
+    
+    def priority(self, node, deltas):
         
-        if n > 4:
+        alpha = node.R_step[3]
+        return (node.n, min(alpha, 1.0 - alpha))
+
+
+class RandomOrder(SearchStrategy):
+    """Deepest nodes first, among them in random order."""
+    
+    name = 'random'
+    
+    def __init__(self, seed=None):
         
-            candidates = _find_candidates(D, V, print_info)
-            
-            # WP3: ensure that given values in B can't be candidates
-            if B != None:
-                temp_cand = candidates.copy()
-                for c in temp_cand:
-                    if c[2] in B:
-                        candidates.remove(c)
-
-            # WP4: select candidate with smallest spike length
-            # create a dict candidate_dependencies for each candidate
-            # candidate_dependencies holds deltas of the triple and a list of candidates with smaller spike lengths as well as the index in the candidates list
-            if choose_smallest_spike and len(candidates) != 1 and n > 5:
-                # structure to save relations between candidates
-                candidate_dependencies = {}
-                for c_i, c in enumerate(candidates):
-                    # compute deltas
-                    c_delt = _compute_deltas(V, D, c[4], c[0], c[1], c[2], c[3])
-                    c_delt = (c_delt[2], c_delt[3], c_delt[0])
-                    c_xyz = (c[0], c[1], c[2])
-                    candidate_dependencies[c_xyz] = [c_delt, [], c_i]
-                    for k, v in candidate_dependencies.items():
-                        # -1 initial state, 0: first triple has smaller delta (k bigger), 1: second triple has smaller delta
-                        compare_state = -1
-                        # succ_state default = True and when first/second triplet delta comparison still smaller
-                        succ_state = True
-                        if k != c_xyz:
-                            for xyz_i, xyz in enumerate(c_xyz):
-                                if xyz in k:
-                                    k_i = k.index(xyz)
-                                    smaller_state = 0 if v[0][k_i] < candidate_dependencies[c_xyz][0][xyz_i] and not np.isclose(v[0][k_i], candidate_dependencies[c_xyz][0][xyz_i]) else 1
-                                    if compare_state == -1 or compare_state == smaller_state:
-                                        compare_state = smaller_state
-                                    elif compare_state != -1 and compare_state != smaller_state:
-                                        succ_state = False
-                                        continue
-                            # append current candidate, small spike found
-                            if succ_state:
-                                if compare_state == 0:
-                                    candidate_dependencies[c_xyz][1].append(k)
-                                elif compare_state == 1:
-                                    candidate_dependencies[k][1].append(c_xyz)
-                c_smallest_spike = []
-                # find all possible candidates with smalles spike
-                for k, v in candidate_dependencies.items():
-                    if not v[1]:
-                        c_smallest_spike.append(candidates[v[2]])
-                # choose random candidate if more than one found
-                if len(c_smallest_spike) > 1:
-                    rand_c = np.random.randint(len(c_smallest_spike))
-                    candidates = [c_smallest_spike[rand_c]]
-                elif len(c_smallest_spike) == 1:
-                    candidates = c_smallest_spike
-                else:
-                    circle = True
-                    
+        self.rng = np.random.default_rng(seed)
         
-            found_valid = False
-            
-            if print_info: 
-                print(f'-----> n = {n}, V = {V} ---> R-steps actually carried out')
-            for x, y, z, u_witness, alpha in candidates:
-                
-                V_copy = V.copy()
-                V_copy.remove(z)
-                
-                child = TreeNode(n-1, V_copy, R_step=(x, y, z, alpha))
-                parent.add_child(child)
-                
-                deltas = _compute_deltas(V, D, alpha, x, y, z, u_witness)
-                
-                if print_info:
-                    print('({}, {}: {}) alpha={:.5f}'.format(x, y, z, alpha),
-                          end='   ')
-                    print('δx = {:.3f}, δy = {:.3f}, '\
-                          'δz = {:.3f}, dxy = {:.3f}'.format(deltas[2],
-                                                             deltas[3],
-                                                             deltas[0],
-                                                             deltas[1]))
-                
-                if not _all_non_negative(deltas):
-                    if print_info: print('         |___ negative δ/dxy')
-                    child.info = 'negative delta/dxy'
-                    continue
-                
-                D_copy = _matrix_without_index(D, V.index(z))
-                _update_matrix(V_copy, D_copy, x, y, deltas[2], deltas[3])
-                child.D = D_copy
-                
-                still_metric, metric_info = is_pseudometric(D_copy,
-                                                            return_info=True,
-                                                            V=V_copy)
-                
-                if not still_metric:
-                    if print_info: print( '         |___ no pseudometric')
-                    if print_info: print(f'         |___ {metric_info}')
-                    child.info = 'no pseudometric'
-                    continue
-                
-                found_valid = True
-                if print_info: print(f'         |___ STACKED {V_copy}')
-                stack.append(child)
-                
-                # for n = 5 always check all candidates
-                if first_candidate_only and n > 5:
-                    break
-                
-            if not candidates or not found_valid:
-                parent.info = 'no candidate'
-                
-        else:
-            if print_info: print(f'-----> n = {n} R-map test')
-            if recognize4_matrix_only(D):
-                if print_info: print(f'SUCCESS on {V}')
-                parent.valid_ways = 1
-            else:
-                if print_info: print(f'NO R-MAP on {V}')
-                parent.info = 'spikes too short'
     
-    _finalize_tree(recognition_tree)
-    return recognition_tree, circle
+    def priority(self, node, deltas):
+        
+        return (node.n, self.rng.random())
+
+
+STRATEGIES = {'dfs': SearchStrategy,
+              'smallest_spike': SmallestSpikeFirst,
+              'alpha_boundary': AlphaBoundaryFirst,
+              'random': RandomOrder}
+
+
+def _complete_node(node, table=None, key=None, failures=None):
+    """Sum up the valid ways of a node whose subtree has been searched, and
+    count the infos of its failed children in the Counter 'failures' (a
+    child reused from the transposition table with valid ways is not a
+    failure)."""
+    
+    for child in node.children:
+        node.valid_ways += child.valid_ways
+        if failures is not None and child.info_code and not child.valid_ways:
+            failures[child.info] += 1
+    
+    if table is not None and key is not None:
+        table.store(key, node.valid_ways, node.info)
+
+
+def _reuse_subproblem(node, D, table):
+    """Look up the node in the transposition table.
+    
+    Returns
+    -------
+    tuple of bool and bytes
+        Whether the stored result was reused, and the key of the node.
+    """
+    
+    if table is None:
+        return False, None
+    
+    key = table.fingerprint(node.V, D)
+    entry = table.lookup(key)
+    
+    if entry is None:
+        return False, key
+    
+    node.valid_ways, info = entry
+    node.info = info if info else 'transposition'
+    
+    return True, key
+
+
+def _set_aggregates(recognition_tree, failures):
+    """Set the aggregates of a recognition tree from the counts collected
+    during the search (the root is the only node not counted by a parent)."""
+    
+    root = recognition_tree.root
+    
+    if root.info_code:
+        failures[root.info] += 1
+    
+    recognition_tree.valid_ways = root.valid_ways
+    recognition_tree.successes = root.valid_ways
+    recognition_tree.failures = failures
+
+
+def _select_candidates(D, V, B, choose_smallest_spike, print_info):
+    """Candidates for the R-step on V after applying the WP3/WP4 filters.
+    
+    Returns
+    -------
+    tuple of list and bool
+        The candidates and whether no candidate with a smallest spike exists
+        (WP4).
+    """
+    
+    candidates = _find_candidates(D, V, print_info)
+    
+    return _filter_candidates(D, V, candidates, B, choose_smallest_spike)
+
+
+def _filter_candidates(D, V, candidates, B, choose_smallest_spike):
+    """Apply the WP3/WP4 filters to the candidates of an R-step on V.
+    
+    Returns
+    -------
+    tuple of list and bool
+        The remaining candidates and whether no candidate with a smallest
+        spike exists (WP4).
+    """
+    
+    n = len(V)
+    circle = False
+    
+    # WP3: ensure that given values in B can't be candidates
+    if B != None:
+        temp_cand = candidates.copy()
+        for c in temp_cand:
+            if c[2] in B:
+                candidates.remove(c)
+
+    # WP4: select candidate with smallest spike length
+    # create a dict candidate_dependencies for each candidate
+    # candidate_dependencies holds deltas of the triple and a list of candidates with smaller spike lengths as well as the index in the candidates list
+    if choose_smallest_spike and len(candidates) != 1 and n > 5:
+        # structure to save relations between candidates
+        candidate_dependencies = {}
+        for c_i, c in enumerate(candidates):
+            # compute deltas
+            c_delt = _compute_deltas(V, D, c[4], c[0], c[1], c[2], c[3])
+            c_delt = (c_delt[2], c_delt[3], c_delt[0])
+            c_xyz = (c[0], c[1], c[2])
+            candidate_dependencies[c_xyz] = [c_delt, [], c_i]
+            for k, v in candidate_dependencies.items():
+                # -1 initial state, 0: first triple has smaller delta (k bigger), 1: second triple has smaller delta
+                compare_state = -1
+                # succ_state default = True and when first/second triplet delta comparison still smaller
+                succ_state = True
+                if k != c_xyz:
+                    for xyz_i, xyz in enumerate(c_xyz):
+                        if xyz in k:
+                            k_i = k.index(xyz)
+                            smaller_state = 0 if v[0][k_i] < candidate_dependencies[c_xyz][0][xyz_i] and not np.isclose(v[0][k_i], candidate_dependencies[c_xyz][0][xyz_i]) else 1
+                            if compare_state == -1 or compare_state == smaller_state:
+                                compare_state = smaller_state
+                            elif compare_state != -1 and compare_state != smaller_state:
+                                succ_state = False
+                                continue
+                    # append current candidate, small spike found
+                    if succ_state:
+                        if compare_state == 0:
+                            candidate_dependencies[c_xyz][1].append(k)
+                        elif compare_state == 1:
+                            candidate_dependencies[k][1].append(c_xyz)
+        c_smallest_spike = []
+        # find all possible candidates with smalles spike
+        for k, v in candidate_dependencies.items():
+            if not v[1]:
+                c_smallest_spike.append(candidates[v[2]])
+        # choose random candidate if more than one found
+        if len(c_smallest_spike) > 1:
+            rand_c = np.random.randint(len(c_smallest_spike))
+            candidates = [c_smallest_spike[rand_c]]
+        elif len(c_smallest_spike) == 1:
+            candidates = c_smallest_spike
+        else:
+            circle = True
+    
+    return candidates, circle
+
+
+def _apply_candidate(D, V, candidate, print_info, matrix=None):
+    """Compute and validate the R-step of a candidate.
+    
+    If 'matrix' is None, the reduced matrix is returned as a new array.
+    Otherwise, the R-step is applied to the shared matrix and reverted after
+    the validation.
+    
+    Returns
+    -------
+    tuple
+        The deltas (delta_z, d_xy, delta_x, delta_y), the reduced matrix (or
+        None), and an info string that is empty if the R-step is valid.
+    """
+    
+    x, y, z, u_witness, alpha = candidate
+    
+    V_copy = V.copy()
+    V_copy.remove(z)
+    
+    deltas = _compute_deltas(V, D, alpha, x, y, z, u_witness)
+    
+    if print_info:
+        print('({}, {}: {}) alpha={:.5f}'.format(x, y, z, alpha),
+              end='   ')
+        print('δx = {:.3f}, δy = {:.3f}, '\
+              'δz = {:.3f}, dxy = {:.3f}'.format(deltas[2],
+                                                 deltas[3],
+                                                 deltas[0],
+                                                 deltas[1]))
+    
+    if not _all_non_negative(deltas):
+        if print_info: print('         |___ negative δ/dxy')
+        return deltas, None, 'negative delta/dxy'
+    
+    if matrix is None:
+        D_copy = _matrix_without_index(D, V.index(z))
+        _update_matrix(V_copy, D_copy, x, y, deltas[2], deltas[3])
+    else:
+        matrix.apply(x, y, z, deltas[2], deltas[3])
+        D_copy = matrix.D
+    
+    # only rows x and y changed, the rest is part of the parent
+    # matrix which is already known to be a pseudometric
+    changed = [V_copy.index(item) 
+               for item, delta in ((x, deltas[2]), (y, deltas[3]))
+               if delta]
+    still_metric, metric_info = is_pseudometric_after_update(
+                                    D_copy, changed,
+                                    return_info=True, V=V_copy)
+    
+    if matrix is not None:
+        matrix.undo()
+        D_copy = None
+    
+    if not still_metric:
+        if print_info: print( '         |___ no pseudometric')
+        if print_info: print(f'         |___ {metric_info}')
+        return deltas, D_copy, 'no pseudometric'
+    
+    if print_info: print(f'         |___ STACKED {V_copy}')
+    return deltas, D_copy, ''
+    
+
+def _expand_node(parent, D, candidates, first_candidate_only, print_info,
+                 matrix=None, store_matrices=True):
+    """Apply the candidate R-steps to a node and attach the children.
+    
+    If 'matrix' is None, every valid child stores its own copy of the reduced
+    matrix (the invalid ones only if 'store_matrices' is True); if
+    'store_matrices' is False, the caller releases the matrix of a valid child
+    once the child has been expanded. Otherwise, the R-steps are applied to
+    the shared matrix and reverted after the validation, and the children do
+    not store matrices.
+    
+    Returns
+    -------
+    list of tuples
+        The valid children, the parameters (x, y, z, delta_x, delta_y) of
+        the R-steps that produced them, and the deltas (delta_z, d_xy,
+        delta_x, delta_y).
+    """
+    
+    V, n = parent.V, parent.n
+    valid_children = []
+    
+    if print_info: 
+        print(f'-----> n = {n}, V = {V} ---> R-steps actually carried out')
+    for candidate in candidates:
+        
+        x, y, z, u_witness, alpha = candidate
+        
+        child = TreeNode(n-1, R_step=(x, y, z, alpha))
+        parent.add_child(child)
+        
+        deltas, D_child, child.info = _apply_candidate(D, V, candidate,
+                                                       print_info,
+                                                       matrix=matrix)
+        
+        if child.info != 'negative delta/dxy':
+            child.deltas = (deltas[2], deltas[3])
+            if store_matrices or not child.info:
+                child.D = D_child
+        
+        if child.info:
+            continue
+        
+        valid_children.append((child, (x, y, z, deltas[2], deltas[3]),
+                               deltas))
+        
+        # for n = 5 always check all candidates
+        if first_candidate_only and n > 5:
+            break
+        
+    if not candidates or not valid_children:
+        parent.info = 'no candidate'
+    
+    return valid_children
+
+
+def _check_leaf(node, D, print_info):
+    
+    if print_info: print(f'-----> n = {node.n} R-map test')
+    if recognize4_matrix_only(D):
+        if print_info: print(f'SUCCESS on {node.V}')
+        node.valid_ways = 1
+    else:
+        if print_info: print(f'NO R-MAP on {node.V}')
+        node.info = 'spikes too short'
+
+
+def _search_copies(root, B, choose_smallest_spike, first_candidate_only,
+                   print_info, table=None, budget=None, open_nodes=None,
+                   stop=None, store_matrices=True, failures=None):
+    """Recognition search in which every node stores its own matrix.
+    
+    The stack holds the nodes to be expanded, and tuples (node, key) marking
+    the point at which the subtree of the node has been searched completely.
+    If 'store_matrices' is False, the matrices of the nodes (except the root)
+    are dropped as soon as they have been expanded (or skipped).
+    
+    If a budget is given, at most this many nodes are expanded; the nodes that
+    remain to be expanded are appended to the list 'open_nodes' instead (their
+    valid ways are not yet included in their ancestors). If the event 'stop'
+    is given, it is set as soon as a success is found, and no further nodes
+    are expanded once it is set.
+    """
+    
+    circle = False
+    stack = [root]
+    expanded = 0
+    
+    while stack:
+        
+        parent = stack.pop()
+        
+        if isinstance(parent, tuple):
+            parent, key = parent
+            _complete_node(parent, table=table, key=key, failures=failures)
+            continue
+        
+        # after a stop, only complete the nodes that were already expanded
+        if stop is not None and stop.is_set():
+            pass
+        
+        elif parent.n > 4:
+            if budget is not None and expanded >= budget:
+                open_nodes.append(parent)
+                continue
+            
+            reused, key = _reuse_subproblem(parent, parent.D, table)
+            if not reused:
+                expanded += 1
+                candidates, no_smallest = _select_candidates(
+                    parent.D, parent.V, B, choose_smallest_spike, print_info)
+                circle = circle or no_smallest
+                
+                stack.append((parent, key))
+                for child, _, _ in _expand_node(
+                        parent, parent.D, candidates, first_candidate_only,
+                        print_info, store_matrices=store_matrices):
+                    stack.append(child)
+        else:
+            _check_leaf(parent, parent.D, print_info)
+            if stop is not None and parent.valid_ways:
+                stop.set()
+        
+        if not store_matrices and parent is not root:
+            parent.D = None
+    
+    return circle
+
+
+def _search_in_place(root, B, choose_smallest_spike, first_candidate_only,
+                     print_info, table=None, failures=None):
+    """Depth-first recognition search on a single shared matrix.
+    
+    The stack holds the nodes to be expanded together with the R-step that
+    leads to them from their parent, and tuples (node, key, reached_by_step)
+    marking the point at which the subtree of the node has been searched
+    completely and the R-step has to be reverted. The children do not store
+    matrices.
+    """
+    
+    circle = False
+    matrix = _SharedMatrix(root.D, root.V)
+    stack = [(root, None)]
+    
+    while stack:
+        
+        entry = stack.pop()
+        
+        if len(entry) == 3:
+            parent, key, reached_by_step = entry
+            _complete_node(parent, table=table, key=key, failures=failures)
+            if reached_by_step:
+                matrix.undo()
+            continue
+        
+        parent, step = entry
+        if step is not None:
+            matrix.apply(*step)
+        
+        reused, key = False, None
+        if parent.n > 4:
+            reused, key = _reuse_subproblem(parent, matrix.D, table)
+        
+        stack.append((parent, key, step is not None))
+        
+        if parent.n <= 4:
+            _check_leaf(parent, matrix.D, print_info)
+        elif not reused:
+            candidates, no_smallest = _select_candidates(matrix.D, matrix.V, B,
+                                                         choose_smallest_spike,
+                                                         print_info)
+            circle = circle or no_smallest
+            
+            stack.extend((child, step) for child, step, _ in
+                         _expand_node(parent, matrix.D, candidates,
+                                      first_candidate_only, print_info,
+                                      matrix=matrix, store_matrices=False))
+    
+    return circle
+    
+    
+def _search_best_first(root, strategy, B, choose_smallest_spike,
+                       first_candidate_only, print_info, table=None,
+                       stop_on_success=False, store_matrices=True,
+                       failures=None):
+    """Recognition search driven by a priority queue (see SearchStrategy).
+    
+    Since the nodes are not completed in stack order, every node counts its
+    children that are still to be searched, and a node is completed as soon
+    as the last of them is.
+    
+    Returns
+    -------
+    tuple
+        Whether no candidate with a smallest spike was found (WP4), the number
+        of expanded nodes, and the number of expanded nodes at the time the
+        first success was found (or None).
+    """
+    
+    circle = False
+    expansions, first_success = 0, None
+    queue = [(0, 0, root)]
+    counter = 0
+    open_children = {}
+    keys = {}
+    
+    def _resolve(node):
+        # complete the node and all ancestors whose subtree is now searched
+        while node is not None:
+            _complete_node(node, table=table, key=keys.pop(node, None),
+                           failures=failures)
+            if node.parent is None:
+                break
+            node = node.parent
+            open_children[node] -= 1
+            if open_children[node]:
+                break
+            del open_children[node]
+    
+    while queue:
+        
+        _, _, parent = heapq.heappop(queue)
+        
+        if stop_on_success and first_success is not None:
+            if not store_matrices:
+                parent.D = None
+            continue
+        
+        if parent.n > 4:
+            reused, key = _reuse_subproblem(parent, parent.D, table)
+            if reused:
+                if not store_matrices:
+                    parent.D = None
+                _resolve(parent)
+                continue
+            
+            expansions += 1
+            candidates, no_smallest = _select_candidates(parent.D, parent.V, B,
+                                                         choose_smallest_spike,
+                                                         print_info)
+            circle = circle or no_smallest
+            
+            children = _expand_node(parent, parent.D, candidates,
+                                    first_candidate_only, print_info,
+                                    store_matrices=store_matrices)
+            
+            if not store_matrices and parent is not root:
+                parent.D = None
+            
+            if not children:
+                _resolve(parent)
+                continue
+            
+            keys[parent] = key
+            open_children[parent] = len(children)
+            for child, _, deltas in children:
+                counter -= 1
+                heapq.heappush(queue, (strategy.priority(child, deltas),
+                                       counter, child))
+        else:
+            _check_leaf(parent, parent.D, print_info)
+            if parent.valid_ways and first_success is None:
+                first_success = expansions
+            if not store_matrices:
+                parent.D = None
+            _resolve(parent)
+    
+    # after a stop, complete the nodes whose subtrees remain unfinished
+    # (deepest first, and without storing the partial results)
+    for node in sorted(open_children, key=lambda v: v.n):
+        _complete_node(node, failures=failures)
+    
+    return circle, expansions, first_success
+
+
+def recognize(D, B=None, choose_smallest_spike=False, first_candidate_only=False, print_info=False,
+              in_place=False, transpositions=None, store_matrices=True,
+              strategy=None, stop_on_success=False):
+    """Recognition of type R matrices.
+    
+    Parameters
+    ----------
+    D : numpy array
+        A distance matrix, or its condensed vector (see tools.Condensed), in
+        which case the nodes of the tree store condensed matrices as well.
+    leaf_identifiers : list
+        a list of leaves, that must not be chosen as z
+    first_candidate_only : bool, optional
+        If True, only consider the first found candidate for a merge event.
+        The default is False.
+    print_info : bool, True
+        If True, print the recognition history. The default is False.
+    in_place : bool, optional
+        If True, the search works depth-first on a single copy of D that is
+        modified in place and restored via an undo log, and only the root of
+        the recognition tree stores a matrix. The default is False, in which
+        case every node stores its own matrix.
+    transpositions : TranspositionTable or bool, optional
+        If a TranspositionTable (or True, in which case a new table is
+        created), subproblems that are equal to an already searched one are
+        not searched again; instead, the corresponding node becomes a leaf
+        with the stored number of valid ways (and info 'transposition' or the
+        stored failure info). The table is accessible as the attribute
+        'transpositions' of the returned tree, and the number of reused
+        subproblems as its attribute 'reused'. The default is None.
+    store_matrices : bool, optional
+        If False, only the root stores its matrix; the matrices of the other
+        nodes are rebuilt from it when accessed. The default is True. Ignored
+        if in_place is True, in which case no matrices are stored.
+    strategy : SearchStrategy or str, optional
+        If given, the nodes are expanded in the order of a priority queue
+        according to the strategy, either an instance of SearchStrategy or
+        one of the names in STRATEGIES ('dfs', 'smallest_spike',
+        'alpha_boundary', 'random'). The number of expanded nodes is
+        available as the attribute 'expansions' of the returned tree, and the
+        number of expansions until the first success as 'first_success_after'.
+        The default is None, i.e., the plain depth-first search (in_place is
+        ignored if a strategy is given).
+    stop_on_success : bool, optional
+        If True and a strategy is given, no further nodes are expanded once a
+        success has been found; the returned tree is then incomplete. The
+        default is False.
+    
+    Returns
+    -------
+    Tree
+        The recognition tree. Its attributes 'valid_ways', 'successes', and
+        'failures' (per reason) are aggregated during the search.
+    
+    See also
+    --------
+    tools.Tree
+    recognize_counts
+    """
+    
+    n = matrix_size(D)
+    V = [i for i in range(n)]
+
+    circle = False
+    failures = Counter()
+    
+    if transpositions is True:
+        transpositions = TranspositionTable()
+    elif transpositions is False:
+        transpositions = None
+    
+    if transpositions is not None:
+        transpositions.set_settings(B, choose_smallest_spike,
+                                    first_candidate_only)
+        hits = transpositions.hits
+    
+    if isinstance(strategy, str):
+        strategy = STRATEGIES[strategy]()
+    
+    recognition_tree = Tree(TreeNode(n, V, D=D))
+    recognition_tree.transpositions = transpositions
+    recognition_tree.reused = 0
+    recognition_tree.strategy = strategy.name if strategy else None
+    recognition_tree.expansions = None
+    recognition_tree.first_success_after = None
+    
+    # trivial failure if not a pseudometric
+    if not is_pseudometric(D):
+        if print_info: print('no pseudometric')
+        recognition_tree.root.info = 'no pseudometric'
+    
+    # every pseudometric is additve and thus also an R matrix
+    elif n <= 3:
+        if print_info: print(print(f'SUCCESS on {V}'))
+        recognition_tree.root.valid_ways = 1
+    
+    # otherwise start the recognition algorithm
+    elif strategy is not None:
+        circle, expansions, first_success = _search_best_first(
+            recognition_tree.root, strategy, B, choose_smallest_spike,
+            first_candidate_only, print_info, table=transpositions,
+            stop_on_success=stop_on_success, store_matrices=store_matrices,
+            failures=failures)
+        recognition_tree.expansions = expansions
+        recognition_tree.first_success_after = first_success
+    elif in_place:
+        circle = _search_in_place(recognition_tree.root, B,
+                                  choose_smallest_spike, first_candidate_only,
+                                  print_info, table=transpositions,
+                                  failures=failures)
+    else:
+        circle = _search_copies(recognition_tree.root, B,
+                                choose_smallest_spike, first_candidate_only,
+                                print_info, table=transpositions,
+                                store_matrices=store_matrices,
+                                failures=failures)
+    
+    if transpositions is not None:
+        recognition_tree.reused = transpositions.hits - hits
+    
+    _set_aggregates(recognition_tree, failures)
+    return recognition_tree, circle
+
+
+def _valid_steps(matrix, B, choose_smallest_spike, first_candidate_only):
+    """Generator for the valid R-steps on the current state of the matrix.
+    
+    Each R-step is validated on the shared matrix and reverted before it is
+    yielded as tuple (x, y, z, alpha, delta_x, delta_y). The generator must
+    only be resumed while the matrix is in the state in which it was started.
+    
+    The R-steps are yielded in the order in which the depth-first search of
+    recognize() visits the children (it pops them from a stack, i.e., the
+    last valid candidate first).
+    """
+    
+    candidates, _ = _select_candidates(matrix.D, matrix.V, B,
+                                       choose_smallest_spike, False)
+    n = len(matrix.V)
+    
+    # for n = 5 always check all candidates
+    if first_candidate_only and n > 5:
+        order = candidates
+    else:
+        order = reversed(candidates)
+    
+    for candidate in order:
+        x, y, z, _, alpha = candidate
+        deltas, _, info = _apply_candidate(matrix.D, matrix.V,
+                                           candidate, False, matrix=matrix)
+        if info:
+            continue
+        
+        yield x, y, z, alpha, deltas[2], deltas[3]
+        
+        if first_candidate_only and n > 5:
+            break
+        
+
+def find_one_history(D, B=None, choose_smallest_spike=False,
+                     first_candidate_only=False):
+    """Search for a single sequence of R-steps that recognizes D.
+    
+    The search runs depth-first on a single copy of D (modified in place) and
+    stops at the first success. Only the R-steps on the current path are
+    kept, no recognition tree is built. The nodes are visited in the same
+    order as in recognize(), so the returned R-steps are those of its first
+    success.
+    
+    With choose_smallest_spike, ties between candidates with a smallest spike
+    are broken with np.random. The result then agrees with that of
+    recognize() only if both start from the same state of np.random (see
+    numpy.random.get_state()); otherwise the two calls can disagree.
+    
+    Parameters
+    ----------
+    D : numpy array
+        A distance matrix or its condensed vector.
+    B : list, optional
+        A list of leaves that must not be chosen as z.
+    choose_smallest_spike : bool, optional
+        Only consider candidates with the smallest spikes (WP4). The default
+        is False.
+    first_candidate_only : bool, optional
+        If True, only consider the first found candidate for a merge event.
+        The default is False.
+    
+    Returns
+    -------
+    list of tuples or None
+        The R-steps (x, y, z, alpha) in the order in which they were applied
+        in the recognition, i.e., in reversed order of the corresponding merge
+        and branching events; or None if D is not recognized as an R matrix.
+    
+    See also
+    --------
+    recognize
+    is_r_matrix
+    """
+    
+    if D.ndim == 1:
+        D = to_matrix(D, dtype=np.float64)
+    
+    n = D.shape[0]
+    
+    if not is_pseudometric(D):
+        return None
+    elif n <= 3:
+        return []
+    elif n == 4:
+        return [] if recognize4_matrix_only(D) else None
+    
+    matrix = _SharedMatrix(D, range(n))
+    history = []
+    steps = [_valid_steps(matrix, B, choose_smallest_spike,
+                          first_candidate_only)]
+    
+    while steps:
+        
+        step = next(steps[-1], None)
+        
+        # all R-steps of this node are exhausted, backtrack
+        if step is None:
+            steps.pop()
+            if history:
+                history.pop()
+                matrix.undo()
+            continue
+        
+        x, y, z, alpha, delta_x, delta_y = step
+        matrix.apply(x, y, z, delta_x, delta_y)
+        history.append((x, y, z, alpha))
+        
+        if len(matrix.V) > 4:
+            steps.append(_valid_steps(matrix, B, choose_smallest_spike,
+                                      first_candidate_only))
+        elif recognize4_matrix_only(matrix.D):
+            return history
+        else:
+            history.pop()
+            matrix.undo()
+    
+    return None
+
+
+def is_r_matrix(D, B=None, choose_smallest_spike=False,
+                first_candidate_only=False):
+    """Decide whether D is recognized as a type R matrix.
+    
+    Parameters are the same as for find_one_history().
+    
+    Returns
+    -------
+    bool
+        True if a sequence of R-steps recognizing D was found.
+    
+    See also
+    --------
+    find_one_history
+    """
+    
+    return find_one_history(D, B=B, choose_smallest_spike=choose_smallest_spike,
+                            first_candidate_only=first_candidate_only) is not None
+
+
+class RecognitionCounts:
+    """Aggregated outcome of a recognition without the recognition tree.
+    
+    Attributes
+    ----------
+    valid_ways : int
+        Total number of recognition paths leading to a success.
+    successes : int
+        Same as valid_ways.
+    failures : collections.Counter
+        Number of nodes of the (not built) recognition tree per info string,
+        i.e., per reason why the recognition failed at a node.
+    """
+    
+    def __init__(self, valid_ways, failures):
+        
+        self.valid_ways = valid_ways
+        self.successes = valid_ways
+        self.failures = failures
+        
+    
+    def __repr__(self):
+        
+        return (f'RecognitionCounts(valid_ways={self.valid_ways}, '
+                f'failures={dict(self.failures)})')
+
+
+def recognize_counts(D, B=None, choose_smallest_spike=False,
+                     first_candidate_only=False):
+    """Recognition of type R matrices that only counts the outcomes.
+    
+    The search is the depth-first search of recognize() on a single copy of D
+    (modified in place), but no recognition tree is built. The numbers are
+    the same as the attributes 'valid_ways', 'successes' and 'failures' of
+    the tree returned by recognize().
+    
+    Parameters are the same as for find_one_history().
+    
+    Returns
+    -------
+    tuple of RecognitionCounts and bool
+        The counts and whether no candidate with a smallest spike was found
+        (WP4).
+    
+    See also
+    --------
+    recognize
+    """
+    
+    if D.ndim == 1:
+        D = to_matrix(D, dtype=np.float64)
+    
+    n = D.shape[0]
+    valid_ways, failures = 0, Counter()
+    circle = False
+    
+    if not is_pseudometric(D):
+        failures['no pseudometric'] += 1
+        return RecognitionCounts(valid_ways, failures), circle
+    elif n <= 3:
+        return RecognitionCounts(1, failures), circle
+    
+    matrix = _SharedMatrix(D, range(n))
+    
+    # the stack holds the R-steps leading to the nodes to be searched, and
+    # None marking the point at which the last R-step has to be reverted
+    stack = [()]
+    
+    while stack:
+        
+        step = stack.pop()
+        
+        if step is None:
+            matrix.undo()
+            continue
+        
+        if step:
+            matrix.apply(*step)
+            stack.append(None)
+        
+        n = len(matrix.V)
+        
+        if n <= 4:
+            if recognize4_matrix_only(matrix.D):
+                valid_ways += 1
+            else:
+                failures['spikes too short'] += 1
+            continue
+        
+        candidates, no_smallest = _select_candidates(matrix.D, matrix.V, B,
+                                                     choose_smallest_spike,
+                                                     False)
+        circle = circle or no_smallest
+        
+        steps = []
+        for candidate in candidates:
+            x, y, z, _, _ = candidate
+            deltas, _, info = _apply_candidate(matrix.D, matrix.V, candidate,
+                                               False, matrix=matrix)
+            if info:
+                failures[info] += 1
+                continue
+            
+            steps.append((x, y, z, deltas[2], deltas[3]))
+            
+            # for n = 5 always check all candidates
+            if first_candidate_only and n > 5:
+                break
+        
+        if not steps:
+            failures['no candidate'] += 1
+        
+        stack.extend(steps)
+    
+    return RecognitionCounts(valid_ways, failures), circle
+
+
+# event shared by the worker processes of recognize_parallel()
+_stop_event = None
+
+
+def _init_worker(stop_event):
+    
+    global _stop_event
+    _stop_event = stop_event
+    
+
+def _search_subtree(V, D, B, choose_smallest_spike, first_candidate_only,
+                    budget, stop_on_success, store_matrices):
+    """Task of recognize_parallel(): search the subtree below (V, D).
+    
+    Returns
+    -------
+    tuple
+        The root of the searched subtree, the list of nodes in it that remain
+        to be expanded, whether no candidate with a smallest spike was found
+        (WP4), and the counted failures in the subtree (except its root).
+    """
+    
+    root = TreeNode(len(V), V, D=D)
+    open_nodes = []
+    failures = Counter()
+    circle = _search_copies(root, B, choose_smallest_spike,
+                            first_candidate_only, False, budget=budget,
+                            open_nodes=open_nodes,
+                            stop=_stop_event if stop_on_success else None,
+                            store_matrices=store_matrices, failures=failures)
+    
+    return root, open_nodes, circle, failures
+
+
+def _graft(node, subtree_root, failures, store_matrices=True):
+    """Replace an open node by the root of its searched subtree."""
+    
+    node.children = subtree_root.children
+    for child in node.children:
+        child.parent = node
+    node.info = subtree_root.info
+    
+    if not store_matrices and node.parent is not None:
+        node.D = None
+    
+    # the open node was counted (without info) by its parent, the root is
+    # counted at the end
+    if node.parent is not None and node.info_code:
+        failures[node.info] += 1
+    
+    # the ancestors are already completed, add the new valid ways to them
+    v = node
+    while v is not None:
+        v.valid_ways += subtree_root.valid_ways
+        v = v.parent
+
+
+def recognize_parallel(D, workers=None, B=None, choose_smallest_spike=False,
+                       first_candidate_only=False, stop_on_success=False,
+                       budget=64, store_matrices=True):
+    """Recognition of type R matrices using a pool of worker processes.
+    
+    The search tree is split into subtrees that are searched by the workers.
+    A worker expands at most 'budget' nodes per task and hands the remaining
+    nodes of its subtree back, where they are queued as new tasks. Idle
+    workers thus take over parts of large subtrees from busy ones. The
+    resulting tree is the same as that of recognize() (except for the random
+    choices with choose_smallest_spike=True).
+    
+    Parameters
+    ----------
+    D : numpy array
+        A distance matrix or its condensed vector.
+    workers : int, optional
+        Number of worker processes. The default is None, in which case the
+        number of CPUs is used.
+    B : list, optional
+        A list of leaves that must not be chosen as z.
+    choose_smallest_spike : bool, optional
+        Only consider candidates with the smallest spikes (WP4). The default
+        is False.
+    first_candidate_only : bool, optional
+        If True, only consider the first found candidate for a merge event.
+        The default is False.
+    stop_on_success : bool, optional
+        If True, all workers stop as soon as one success has been found, e.g.,
+        if the only question is whether D is an R matrix. The returned tree is
+        then incomplete. The default is False.
+    budget : int, optional
+        Maximal number of nodes that are expanded per task. The default is 64.
+    store_matrices : bool, optional
+        If False, only the root stores its matrix; the matrices of the other
+        nodes are rebuilt from it when accessed (and are not sent back from
+        the workers). The default is True.
+    
+    Returns
+    -------
+    Tree
+        The recognition tree.
+    
+    See also
+    --------
+    recognize
+    """
+    
+    n = matrix_size(D)
+    V = [i for i in range(n)]
+    
+    circle = False
+    failures = Counter()
+    
+    recognition_tree = Tree(TreeNode(n, V, D=D))
+    recognition_tree.transpositions = None
+    recognition_tree.reused = 0
+    root = recognition_tree.root
+    
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    # trivial failure if not a pseudometric
+    if not is_pseudometric(D):
+        root.info = 'no pseudometric'
+        
+    # every pseudometric is additve and thus also an R matrix
+    elif n <= 3:
+        root.valid_ways = 1
+    
+    elif n == 4:
+        _check_leaf(root, root.D, False)
+    
+    else:
+        # split the upper part of the tree breadth-first among the workers
+        open_nodes = [root]
+        while open_nodes and len(open_nodes) < 2 * workers:
+            node = open_nodes.pop(0)
+            subtree_root = TreeNode(node.n, node.V, D=node.D)
+            circle = _search_copies(subtree_root, B, choose_smallest_spike,
+                                    first_candidate_only, False, budget=1,
+                                    open_nodes=open_nodes,
+                                    store_matrices=store_matrices,
+                                    failures=failures) or circle
+            _graft(node, subtree_root, failures, store_matrices)
+        
+        if stop_on_success and root.valid_ways:
+            open_nodes = []
+        
+        context = multiprocessing.get_context()
+        stop_event = context.Event()
+        
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(stop_event,)) as executor:
+            
+            def _submit(node):
+                return executor.submit(_search_subtree, node.V, node.D, B,
+                                       choose_smallest_spike,
+                                       first_candidate_only, budget,
+                                       stop_on_success, store_matrices)
+            
+            pending = {_submit(node): node for node in open_nodes}
+            
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                
+                for future in done:
+                    node = pending.pop(future)
+                    (subtree_root, new_open, no_smallest,
+                     subtree_failures) = future.result()
+                    failures.update(subtree_failures)
+                    _graft(node, subtree_root, failures, store_matrices)
+                    circle = circle or no_smallest
+                    
+                    if stop_on_success and root.valid_ways:
+                        stop_event.set()
+                        continue
+                    
+                    for open_node in new_open:
+                        pending[_submit(open_node)] = open_node
+                
+                if stop_event.is_set():
+                    for future in pending:
+                        future.cancel()
+                    pending = {f: v for f, v in pending.items()
+                               if not f.cancelled()}
+    
+    _set_aggregates(recognition_tree, failures)
+    return recognition_tree, circle
+
+
+# ----------------------------------------------------------------------------
+#                         batched recognition
+# ----------------------------------------------------------------------------
+
+def _batch_chunks(k, entries, max_elements=2**21):
+    """Slices of a batch of k matrices such that the temporary arrays of a
+    slice hold at most about max_elements float64 entries, where 'entries' is
+    their total number of entries per matrix."""
+    
+    size = max(1, max_elements // max(1, entries))
+    
+    return [slice(i, min(i + size, k)) for i in range(0, k, size)]
+
+
+def _is_pseudometric_batch(D, rtol=1e-05, atol=1e-08):
+    """Vectorized is_pseudometric() for a stack of matrices of shape (k, n, n).
+    
+    Returns
+    -------
+    numpy array of bool
+        Whether the matrices are pseudometrics.
+    """
+    
+    k, n = D.shape[0], D.shape[1]
+    result = np.empty(k, dtype=bool)
+    upper = np.triu(np.ones((n, n), dtype=bool), k=1)
+    
+    # the sums for the triangle inequality dominate (n**3 per matrix)
+    for chunk in _batch_chunks(k, n**3):
+        M = D[chunk]
+        
+        ok = np.all(np.logical_or(np.isclose(M, 0.0, rtol=rtol, atol=atol),
+                                  M > 0.0), axis=(1, 2))
+        ok &= ~np.any(np.diagonal(M, axis1=1, axis2=2), axis=1)
+        
+        M_T = M.transpose(0, 2, 1)
+        ok &= np.all(np.abs(M - M_T) <= atol + rtol * np.abs(M_T), axis=(1, 2))
+        
+        # triangle inequality for the pairs i < j
+        minimum = np.min(M[:, :, :, None] + M[:, None, :, :], axis=2)
+        violated = np.logical_and(
+            minimum < M,
+            np.abs(minimum - M) > atol + rtol * np.abs(M))
+        ok &= ~np.any(violated & upper, axis=(1, 2))
+        
+        result[chunk] = ok
+    
+    return result
+
+
+def _is_pseudometric_after_update_batch(D, positions, rtol=1e-05, atol=1e-08):
+    """Vectorized is_pseudometric_after_update() for a stack of matrices.
+    
+    Parameters
+    ----------
+    D : 3-dimensional numpy array
+        Stack of matrices of shape (k, n, n).
+    positions : list of tuples
+        Tuples (p, active) of integer arrays of shape (k,) with the changed
+        row of each matrix and boolean arrays marking whether it has changed
+        at all.
+    
+    Returns
+    -------
+    numpy array of bool
+        Whether the matrices are (still) pseudometrics.
+    """
+    
+    k = D.shape[0]
+    result = np.ones(k, dtype=bool)
+    batch = np.arange(k)
+    
+    for p, active in positions:
+        
+        b, p = batch[active], p[active]
+        M = D[b]
+        row, col = D[b, p, :], D[b, :, p]
+        
+        ok = np.all(np.logical_or(np.isclose(row, 0.0, rtol=rtol, atol=atol),
+                                  row > 0.0), axis=1)
+        ok &= D[b, p, p] == 0.0
+        ok &= np.all(np.abs(row - col) <= atol + rtol * np.abs(col), axis=1)
+        
+        # (1) triangles with an edge p--j
+        minimum = np.min(row[:, :, None] + M, axis=1)
+        ok &= ~np.any(np.logical_and(
+                          minimum < row,
+                          np.abs(minimum - row) > atol + rtol * np.abs(row)),
+                      axis=1)
+        
+        # (2) triangles with p in the middle
+        sums = col[:, :, None] + row[:, None, :]
+        ok &= ~np.any(np.logical_and(
+                          sums < M,
+                          np.abs(sums - M) > atol + rtol * np.abs(M)),
+                      axis=(1, 2))
+        
+        result[b] &= ok
+    
+    return result
+
+
+def _recognize4_batch(D):
+    """Vectorized recognize4_matrix_only() for a stack of 4x4 matrices."""
+    
+    # with the batch as last axis, the scalar formulas work elementwise
+    D_T = D.transpose(1, 2, 0)
+    
+    xy_zu, xz_yu, xu_yz = distance_sums_matrix(D_T, 0, 1, 2, 3)
+    maximum = np.maximum(np.maximum(xy_zu, xz_yu), xu_yz)
+    
+    result = np.where(xy_zu == maximum,
+                      _recognize4_xy_zu(D_T, 0, 1, 2, 3),
+                      np.where(xz_yu == maximum,
+                               _recognize4_xy_zu(D_T, 0, 2, 1, 3),
+                               _recognize4_xy_zu(D_T, 0, 3, 1, 2)))
+    
+    return _is_pseudometric_batch(D) & result
+
+
+def _compute_deltas_batch(D, x, y, z, u, alpha):
+    """Vectorized _compute_deltas() on the positions x, y, z, u of a stack of
+    matrices D (one R-step per matrix)."""
+    
+    b = np.arange(D.shape[0])
+    xy, xz, yz = D[b, x, y], D[b, x, z], D[b, y, z]
+    
+    delta_z = _compute_delta_z(xy, xz, yz)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d_xy = _compute_d_xy(alpha, xz, yz, D[b, u, x], D[b, u, y], D[b, u, z],
+                             delta_z)
+        delta_x = _compute_delta_x(alpha, xz, d_xy, delta_z)
+        delta_y = _compute_delta_y(alpha, yz, d_xy, delta_z)
+    
+    # handle alpha in {0, 1}
+    boundary = (alpha == 0.0) | (alpha == 1.0)
+    d_xy = np.where(boundary, xy, d_xy)
+    delta_x = np.where(boundary, 0.0, delta_x)
+    delta_y = np.where(boundary, 0.0, delta_y)
+    
+    return delta_z, d_xy, delta_x, delta_y
+
+
+def _reduce_batch(D, x, y, z, delta_x, delta_y):
+    """Vectorized _matrix_without_index() and _update_matrix() for a stack of
+    matrices D (one R-step per matrix).
+    
+    Returns
+    -------
+    tuple
+        The reduced matrices of shape (k, n-1, n-1) and the positions of x
+        and y in them.
+    """
+    
+    k, n = D.shape[0], D.shape[1]
+    b = np.arange(k)
+    
+    keep = np.arange(n-1)[None, :]
+    keep = keep + (keep >= z[:, None])
+    D_new = D[b[:, None, None], keep[:, :, None], keep[:, None, :]]
+    
+    x, y = x - (x > z), y - (y > z)
+    
+    for p, delta in ((x, delta_x), (y, delta_y)):
+        i = np.flatnonzero(delta)             # if not 0.0
+        D_new[i, :, p[i]] -= delta[i, None]
+        D_new[i, p[i], :] -= delta[i, None]
+        D_new[i, p[i], p[i]] = 0.0
+    
+    return D_new, x, y
+
+
+def _expand_batch(nodes, B, choose_smallest_spike, first_candidate_only,
+                  store_matrices):
+    """Expand a list of nodes of the same size n > 4 at once.
+    
+    Candidates, deltas, reduced matrices, and the pseudometric checks are
+    computed for all nodes (and all their candidates) in vectorized form, the
+    children are attached as in _expand_node().
+    
+    Returns
+    -------
+    tuple of list and list
+        The valid children and, per node, whether no candidate with a
+        smallest spike was found (WP4).
+    """
+    
+    n = nodes[0].n
+    D = np.stack([node.D for node in nodes])
+    V = np.array([node.V for node in nodes])
+    
+    circles = []
+    steps = []          # (node index, x, y, z, u, alpha) with positions
+    
+    # the candidate search holds about four temporaries of the size of the
+    # alpha tensor of the last y ((n-1) * n**3 entries per matrix) at once
+    for chunk in _batch_chunks(len(nodes), 4 * (n-1) * n**3):
+        accepted, undefined, _, snapped, witness = _candidate_arrays(D[chunk],
+                                                                     V[chunk])
+        for i in range(chunk.start, chunk.stop):
+            node, c = nodes[i], i - chunk.start
+            candidates = _candidate_list(node.V, accepted[c], undefined[c],
+                                         snapped[c], witness[c])
+            candidates, no_smallest = _filter_candidates(node.D, node.V,
+                                                         candidates, B,
+                                                         choose_smallest_spike)
+            circles.append(no_smallest)
+            index = {item: pos for pos, item in enumerate(node.V)}
+            steps.extend((i, index[x], index[y], index[z], index[u], alpha)
+                         for x, y, z, u, alpha in candidates)
+    
+    valid_children = []
+    
+    if steps:
+        i, x, y, z, u = (np.array([s[j] for s in steps], dtype=int)
+                         for j in range(5))
+        alpha = np.array([s[5] for s in steps], dtype=float)
+        parent_D = D[i]
+        
+        deltas = _compute_deltas_batch(parent_D, x, y, z, u, alpha)
+        non_negative = np.all([np.logical_or(np.isclose(d, 0.0), d > 0.0)
+                               for d in deltas], axis=0)
+        
+        reduced = np.flatnonzero(non_negative)
+        D_new, x_new, y_new = _reduce_batch(parent_D[reduced], x[reduced],
+                                            y[reduced], z[reduced],
+                                            deltas[2][reduced],
+                                            deltas[3][reduced])
+        metric = _is_pseudometric_after_update_batch(
+                     D_new, [(x_new, deltas[2][reduced] != 0.0),
+                             (y_new, deltas[3][reduced] != 0.0)])
+        reduced_index = {s: r for r, s in enumerate(reduced)}
+    
+    # attach the children in the order of the candidates
+    done = set()
+    for s, (i, x, y, z, u, alpha) in enumerate(steps):
+        
+        if i in done:
+            continue
+        
+        parent = nodes[i]
+        V_parent = parent.V
+        child = TreeNode(n-1, R_step=(V_parent[x], V_parent[y], V_parent[z],
+                                      alpha))
+        parent.add_child(child)
+        
+        if not non_negative[s]:
+            child.info = 'negative delta/dxy'
+            continue
+        
+        child.deltas = (deltas[2][s], deltas[3][s])
+        r = reduced_index[s]
+        if store_matrices or metric[r]:
+            child.D = D_new[r]
+        
+        if not metric[r]:
+            child.info = 'no pseudometric'
+            continue
+        
+        valid_children.append(child)
+        
+        # for n = 5 always check all candidates
+        if first_candidate_only and n > 5:
+            done.add(i)
+    
+    for node in nodes:
+        if not node.children or all(child.info for child in node.children):
+            node.info = 'no candidate'
+    
+    return valid_children, circles
+
+
+def recognize_batch(Ds, B=None, choose_smallest_spike=False,
+                    first_candidate_only=False, store_matrices=True):
+    """Recognition of many type R matrices at once.
+    
+    The recognition trees of all matrices are built level by level. In each
+    level, the nodes of the same size (across all matrices) are expanded
+    together, i.e., the candidate search, the R-steps, and the pseudometric
+    checks are vectorized over the batch dimension. This gives a much higher
+    throughput than calling recognize() for each of many small matrices.
+    
+    Parameters
+    ----------
+    Ds : numpy array or list of numpy arrays
+        A stack of distance matrices of shape (k, n, n) (or of their condensed
+        vectors), or a list of distance matrices that may have different
+        sizes.
+    B : list, optional
+        A list of leaves that must not be chosen as z (applies to all
+        matrices).
+    choose_smallest_spike : bool, optional
+        Only consider candidates with the smallest spikes (WP4). The random
+        choices are drawn in a different order than by recognize(). The
+        default is False.
+    first_candidate_only : bool, optional
+        If True, only consider the first found candidate for a merge event.
+        The default is False.
+    store_matrices : bool, optional
+        If False, only the roots store their matrix; the matrices of the other
+        nodes are rebuilt from it when accessed. The default is True.
+    
+    Returns
+    -------
+    list of tuples
+        For each matrix, the recognition tree and whether no candidate with a
+        smallest spike was found (WP4), as returned by recognize().
+    
+    See also
+    --------
+    recognize
+    """
+    
+    trees = []
+    circles = []
+    frontier = []           # (node, index of the matrix)
+    
+    for k, D in enumerate(Ds):
+        n = matrix_size(D)
+        recognition_tree = Tree(TreeNode(n, [i for i in range(n)], D=D))
+        recognition_tree.transpositions = None
+        recognition_tree.reused = 0
+        recognition_tree.strategy = None
+        recognition_tree.expansions = None
+        recognition_tree.first_success_after = None
+        trees.append(recognition_tree)
+        circles.append(False)
+        frontier.append((recognition_tree.root, k))
+    
+    # trivial failure if not a pseudometric, and every pseudometric is
+    # additive and thus also an R matrix
+    by_size = {}
+    for entry in frontier:
+        by_size.setdefault(entry[0].n, []).append(entry)
+    frontier = []
+    for n, entries in by_size.items():
+        metric = _is_pseudometric_batch(np.stack([v.D for v, _ in entries]))
+        for (v, k), is_metric in zip(entries, metric):
+            if not is_metric:
+                v.info = 'no pseudometric'
+            elif n <= 3:
+                v.valid_ways = 1
+            else:
+                frontier.append((v, k))
+    
+    levels = []
+    
+    while frontier:
+        
+        levels.append(frontier)
+        by_size = {}
+        for entry in frontier:
+            by_size.setdefault(entry[0].n, []).append(entry)
+        frontier = []
+        
+        for n, entries in by_size.items():
+            nodes = [v for v, _ in entries]
+            
+            if n == 4:
+                success = _recognize4_batch(np.stack([v.D for v in nodes]))
+                for v, is_success in zip(nodes, success):
+                    if is_success:
+                        v.valid_ways = 1
+                    else:
+                        v.info = 'spikes too short'
+                    if not store_matrices and v.parent is not None:
+                        v.D = None
+                continue
+            
+            children, no_smallest = _expand_batch(nodes, B,
+                                                  choose_smallest_spike,
+                                                  first_candidate_only,
+                                                  store_matrices)
+            matrix_of = {}
+            for (v, k), circle in zip(entries, no_smallest):
+                circles[k] = circles[k] or circle
+                matrix_of[id(v)] = k
+            for child in children:
+                frontier.append((child, matrix_of[id(child.parent)]))
+            
+            if not store_matrices:
+                for v in nodes:
+                    if v.parent is not None:
+                        v.D = None
+    
+    # the children of a node are in the next level
+    failures = [Counter() for _ in trees]
+    for level in reversed(levels):
+        for v, k in level:
+            if v.n > 4:
+                _complete_node(v, failures=failures[k])
+    
+    for recognition_tree, tree_failures in zip(trees, failures):
+        _set_aggregates(recognition_tree, tree_failures)
+    
+    return list(zip(trees, circles))
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import os
+import tempfile
+
 import numpy as np
 
+import erdbeermet.tools.Condensed as Condensed
 import erdbeermet.tools.FileIO as FileIO
+from erdbeermet.tools.History import History
 
 
 class Scenario:
@@ -12,12 +17,17 @@ class Scenario:
     ----------
     N : int
         Number of items.
-    history : list of tuples
+    history : History or list of tuples
         The history of merge and branching events.
     circular : bool
         Indicates whether the scenario has a circular type R matrix
-    D : 2-dimensional numpy array
-        The distance matrix.
+    D : numpy array
+        The distance matrix, or its condensed vector (see tools.Condensed) if
+        the scenario was created with condensed=True.
+    
+    The distance matrix and the circular order are computed on first access
+    only. The circularity is determined from the history alone, i.e., without
+    building the matrix.
     
     See Also
     --------
@@ -26,20 +36,57 @@ class Scenario:
     load()
     """
     
-    def __init__(self, history):
+    def __init__(self, history, condensed=False, dtype=None, out=None):
         """Constructor for Scenario class.
         
         Parameters
         ----------
-        history : list of tuples
+        history : History or list of tuples
             The history of merge and branching events.
+        condensed : bool, optional
+            If True, the distance matrix is stored as the condensed vector of
+            its upper triangle (scipy squareform format). The default is
+            False.
+        dtype : numpy dtype, optional
+            Data type of the distances, e.g. np.float32 to save memory for
+            very large scenarios. The default is None, i.e., float64. Note
+            that the tolerances of the recognition are meant for float64;
+            float32 matrices are mostly not recognized as R matrices.
+        out : str or numpy array, optional
+            A filename, in which case the distance matrix is built into a
+            np.memmap of this file (for scenarios whose matrix does not fit
+            into memory), or an array in which the matrix is built. The
+            default is None.
         """
         
         self.N = len(history) + 1
         self.history = history
+        self.condensed = condensed
+        self.dtype = dtype
+        self.out = out
+        
+        self._D = None
+        self._circular = None
+        self._circ_order = None
+        
+    
+    @property
+    def D(self):
         
-        self._build_matrix()
+        if self._D is None:
+            self._build_matrix()
         
+        return self._D
+    
+    
+    @property
+    def circular(self):
+        
+        if self._circular is None:
+            self._build_circular_order()
+        
+        return self._circular
+    
     
     def distances(self):
         """Distance matrix of the scenario.
@@ -57,7 +104,7 @@ class Scenario:
         
         Returns
         -------
-        list of tuples
+        History or list of tuples
         """
         
         return self.history
@@ -89,16 +136,41 @@ class Scenario:
         return order
     
     
-    def write_history(self, filename):
+    def iter_prefix_matrices(self):
+        """Distance matrices of the prefixes of the history.
+        
+        The matrices are obtained from a single incremental build. The k-th
+        matrix (k = 1, ..., N) is identical to the distance matrix of
+        scenario_from_history(history, stop_after=k).
+        
+        Yields
+        ------
+        2-dimensional numpy array
+            The k x k distance matrix after the first k-1 events as a
+            read-only view, which is only valid until the next iteration
+            (copy it to keep it).
+        """
+        
+        return _iter_distance_matrices(self.history, self.N)
+    
+    
+    def write_history(self, filename, binary=False):
         """Write the event history into a file.
         
         Parameters
         ----------
         filename : str
             Path and filename.
+        binary : bool, optional
+            If True, the history is written in the binary format (see
+            tools.FileIO), which is smaller and can be memory-mapped by
+            load(). The default is False, i.e., the text format.
         """
         
-        FileIO.write_history(filename, self.history)
+        if binary:
+            FileIO.write_history_binary(filename, self.history)
+        else:
+            FileIO.write_history(filename, self.history)
     
     
     def print_history(self):
@@ -111,74 +183,272 @@ class Scenario:
     
     
     def _build_matrix(self):
-        """Generate the distance matrix and determine whether it is circular.
-        """
+        """Generate the distance matrix."""
+        
+        out = self.out
+        
+        if isinstance(out, (str, os.PathLike)):
+            shape = ((Condensed.condensed_size(self.N),) if self.condensed
+                     else (self.N, self.N))
+            out = np.memmap(out, dtype=self.dtype or np.float64, mode='w+',
+                            shape=shape)
         
-        self.D = np.zeros((self.N, self.N))
-        D = self.D
+        self._D = _distance_matrix(self.history, self.N, out=out,
+                                   condensed=self.condensed, dtype=self.dtype)
+        
+        if isinstance(out, np.memmap):
+            out.flush()
+        
+    
+    def _build_circular_order(self):
+        """Determine whether the scenario is circular (and the circular order)
+        from the history."""
         
         # initialize circular as True and set to False if non-neighbor merge
         # event is encountered
-        self.circular = True
-        self._circ_order = {0: 0}
+        circular = True
+        circ_order = {0: 0}
             
         for x, y, z, alpha, delta in self.history:
             
             # simple duplication event
-            if (x == y or
-                (x is None) or (y is None) or
-                alpha == 1.0 or alpha == 0.0):
+            if _is_duplication(x, y, alpha):
                 
                 if x is None or alpha == 0.0:
                     x = y
                     
-                D[x, z] = 0.0
-                D[z, x] = 0.0
-                
-                for u in range(z):
-                    D[u, z] = D[x, z]
-                    D[z, u] = D[x, z]
-                    
-                if self.circular:
-                    old_succ = self._circ_order[x]
-                    self._circ_order[x] = z
-                    self._circ_order[z] = old_succ
+                if circular:
+                    old_succ = circ_order[x]
+                    circ_order[x] = z
+                    circ_order[z] = old_succ
                     
             # recombination event      
+            elif circular:
+                if circ_order[x] == y:
+                    circ_order[x] = z
+                    circ_order[z] = y
+                elif circ_order[y] == x:
+                    circ_order[y] = z
+                    circ_order[z] = x
+                else:
+                    circular = False
+        
+        self._circular = circular
+        self._circ_order = circ_order
+
+
+def _is_duplication(x, y, alpha):
+    
+    return (x == y or
+            (x is None) or (y is None) or
+            alpha == 1.0 or alpha == 0.0)
+
+
+def _distance_matrix(history, N, block_size=32, max_elements=2**13,
+                     out=None, condensed=False, dtype=None):
+    """Distance matrix of a history of merge and branching events.
+    
+    The result is bit-for-bit identical to applying the events one by one,
+    i.e., every entry D[p,q] receives the increments delta[p] + delta[q] of
+    the events after its creation one after another. To avoid touching the
+    whole matrix in every event, the events are processed in blocks: during a
+    block, only the rows of the items created in the block are updated, while
+    the increments of the items created before are collected and folded in
+    in cache-sized bands of rows at the end of the block. The rows of earlier
+    items that are needed for a merge event are brought up to date on the
+    fly. Until the end, only the upper triangle is maintained, as a condensed
+    vector.
+    
+    Parameters
+    ----------
+    history : list of tuples
+        The history of merge and branching events.
+    N : int
+        Number of items.
+    block_size : int, optional
+        Number of events per block. The default is 32.
+    max_elements : int, optional
+        Maximal number of entries of the bands in which the increments of a
+        block are folded in. The default is 2**13.
+    out : numpy array, optional
+        Array of shape (N, N) (or of the length of the condensed vector if
+        'condensed' is True) in which the matrix is built, e.g. a np.memmap.
+        In the latter case, also the upper triangle is kept in a temporary
+        memory-mapped file, i.e., the memory needed (apart from the mapped
+        pages) is O(block_size * N). The default is None, in which case a new
+        array is allocated.
+    condensed : bool, optional
+        If True, return the condensed vector of the matrix (see
+        tools.Condensed). The default is False.
+    dtype : numpy dtype, optional
+        Data type of the result if 'out' is not given. The default is None,
+        i.e., float64. With float32, the distances are rounded at the end of
+        every block (and are thus not identical to the float64 ones); their
+        rounding errors exceed the default tolerances of recognize(), so that
+        such matrices are mostly not recognized as R matrices.
+        
+    Returns
+    -------
+    numpy array
+        The distance matrix or its condensed vector.
+    """
+    
+    if out is not None:
+        dtype = out.dtype
+    elif dtype is None:
+        dtype = np.float64
+    
+    if condensed and out is not None:
+        upper = out
+        upper[:] = 0.0
+    elif isinstance(out, np.memmap):
+        upper = np.memmap(tempfile.TemporaryFile(
+                              dir=os.path.dirname(os.path.abspath(out.filename))),
+                          dtype=dtype, mode='w+',
+                          shape=(Condensed.condensed_size(N),))
+    else:
+        upper = np.zeros(Condensed.condensed_size(N), dtype=dtype)
+    
+    # rows of the items of the current block (lower triangle)
+    strip = np.zeros((block_size, N))
+    
+    s0 = 1              # items created before the current block
+    pending = []        # increments of the current block
+    
+    for i, (x, y, z, alpha, delta) in enumerate(history):
+        
+        if z != i + 1:
+            raise RuntimeError(f'invalid item z={z} in event {i}')
+        
+        delta = np.asarray(delta, dtype=float)
+        row = strip[z-s0]
+        
+        # simple duplication event
+        if _is_duplication(x, y, alpha):
+            row[:z] = 0.0
+        
+        # recombination event
+        else:
+            row_x = _current_row(upper, strip, N, x, z, s0, pending)
+            row_y = _current_row(upper, strip, N, y, z, s0, pending)
+            
+            row[:z] = alpha * row_x + (1 - alpha) * row_y
+            row[x] = (1 - alpha) * row_x[y]
+            row[y] = alpha * row_x[y]
+        
+        # distance increment, i.e., independent evolution after event
+        if len(delta) != z + 1:
+            raise RuntimeError(f'invalid length of delta array for z={z}')
+        
+        strip[:z-s0+1, :z+1] += delta[s0:z+1, None] + delta[None, :z+1]
+        pending.append(delta[:s0])
+        
+        if len(pending) == block_size or z == N - 1:
+            _fold_increments(upper, N, s0, pending, max_elements)
+            
+            # move the rows of the block into the upper triangle (in the
+            # order of the condensed vector)
+            u = np.arange(z + 1)[:, None]
+            a = np.arange(s0, z + 1)[None, :]
+            mask = u < a
+            upper[Condensed.condensed_index(N, u, a)[mask]] = \
+                strip[:z-s0+1, :z+1].T[mask]
+            
+            s0, pending = z + 1, []
+    
+    if condensed:
+        return upper
+    
+    return Condensed.to_matrix(upper, out=out)
+
+
+def _current_row(upper, strip, N, x, z, s0, pending):
+    """Distances of x to the items u < z during the block of _distance_matrix
+    that started with item s0."""
+    
+    row = np.empty(z)
+    row[x] = 0.0            # the pending increments are added to it as well
+    
+    if x < s0:
+        row[:x] = upper[Condensed.condensed_index(N, np.arange(x), x)]
+        row[x+1:s0] = upper[Condensed.row_slice(N, x, x+1, s0)]
+        old = row[:s0]
+        for delta in pending:
+            old += delta[x] + delta
+        row[s0:] = strip[:z-s0, x]
+    else:
+        row[:x] = strip[x-s0, :x]
+        row[x+1:] = strip[x+1-s0:z-s0, x]
+    
+    row[x] = 0.0
+    
+    return row
+
+
+def _fold_increments(upper, N, s0, pending, max_elements):
+    """Add the increments of a block to the upper triangle of the first s0
+    items in bands of rows (in the order of the events)."""
+    
+    if s0 < 2 or not pending:
+        return
+    
+    h = max(1, max_elements // s0)
+    
+    for r0 in range(0, s0 - 1, h):
+        r1 = min(r0 + h, s0 - 1)
+        
+        # row p of the band holds D[p, p+1:s0] from column p+1-r0 on
+        band = np.empty((r1 - r0, s0 - r0))
+        for p in range(r0, r1):
+            band[p-r0, p+1-r0:] = upper[Condensed.row_slice(N, p, p+1, s0)]
+        
+        increment = np.empty(band.shape)
+        for delta in pending:
+            np.add(delta[r0:r1, None], delta[None, r0:s0], out=increment)
+            band += increment
+        
+        for p in range(r0, r1):
+            upper[Condensed.row_slice(N, p, p+1, s0)] = band[p-r0, p+1-r0:]
+
+
+def _iter_distance_matrices(history, N):
+    """Build the distance matrix of a history event by event and yield the
+    leading k x k block after each event as a read-only view."""
+    
+    D = np.zeros((N, N))
+    
+    for z in range(N):
+        
+        if z > 0:
+            x, y, z_event, alpha, delta = history[z-1]
+            
+            if z_event != z:
+                raise RuntimeError(f'invalid item z={z_event} in event {z-1}')
+            
+            if _is_duplication(x, y, alpha):
+                D[z, :z] = 0.0
             else:
-                if self.circular:
-                    if self._circ_order[x] == y:
-                        self._circ_order[x] = z
-                        self._circ_order[z] = y
-                    elif self._circ_order[y] == x:
-                        self._circ_order[y] = z
-                        self._circ_order[z] = x
-                    else:
-                        self.circular = False
-                
-                for u in range(z):
-                    if u != x and u != y:
-                        
-                        d = alpha * D[x, u] + (1 - alpha) * D[y, u]
-                        D[u, z] = d
-                        D[z, u] = d
-                        
-                D[z, x] = (1 - alpha) * D[x, y]
-                D[x, z] = (1 - alpha) * D[x, y]
-                D[z, y] = alpha * D[x, y]
-                D[y, z] = alpha * D[x, y]
+                row = alpha * D[x, :z] + (1 - alpha) * D[y, :z]
+                row[x] = (1 - alpha) * D[x, y]
+                row[y] = alpha * D[x, y]
+                D[z, :z] = row
+            D[:z, z] = D[z, :z]
             
             # distance increment, i.e., independent evolution after event
+            delta = np.asarray(delta, dtype=float)
             if len(delta) != z + 1:
                 raise RuntimeError(f'invalid length of delta array for z={z}')
-                        
-            for p in range(z):
-                for q in range(p+1, z+1):
-                    D[p, q] += delta[p] + delta[q]
-                    D[q, p] = D[p, q]
+            
+            D[:z+1, :z+1] += delta[:, None] + delta[None, :]
+            D[np.arange(z+1), np.arange(z+1)] = 0.0
+        
+        view = D[:z+1, :z+1]
+        view.flags.writeable = False
+        yield view
 
 
-def random_history(N, branching_prob=0.0, circular=False, clocklike=False):
+def random_history(N, branching_prob=0.0, circular=False, clocklike=False,
+                   rng=None):
     """Generate a random history of merge and branching events.
     
     Parameters
@@ -197,14 +467,22 @@ def random_history(N, branching_prob=0.0, circular=False, clocklike=False):
         increments) and only varies between iteration. The default is False,
         in which case the increments are also drawn independently for the
         items within an iteration.
+    rng : numpy.random.Generator, optional
+        If given, all random numbers are drawn from this generator at once
+        instead of one by one from the global numpy.random state. The default
+        is None.
         
     Returns
     -------
-    list of tuples
-        Each tuple corresponds to an iteration comprising a merge or branching
+    History
+        Each event corresponds to an iteration comprising a merge or branching
         event and the distance increments.
     """
     
+    if rng is not None:
+        return _random_history_bulk(N, rng, branching_prob, circular,
+                                    clocklike)
+    
     history = []
     
     if circular:
@@ -243,10 +521,118 @@ def random_history(N, branching_prob=0.0, circular=False, clocklike=False):
                 
         history.append( (x, y, z, alpha, delta) )
     
-    return history
+    return History.from_events(history)
+
+
+def _random_events(N, rng, branching_prob, circular, clocklike):
+    """Parameters of a random history with all random numbers drawn at once
+    from rng.
+    
+    Returns
+    -------
+    tuple of numpy arrays
+        The items x and y, the alphas (1.0 for pure branching events), the
+        concatenated distance increments of all events, and the offsets of the
+        increments of the events in the latter (of length N).
+    """
+    
+    z = np.arange(1, N)
+    
+    branching = rng.random(N-1) < branching_prob
+    branching[:1] = True
+    x = rng.integers(0, z)
+    other = rng.integers(0, np.maximum(z - 1, 1))
+    alpha = rng.random(N-1)
+    
+    # offsets of the distance increments delta (of length z+1) of the events
+    offsets = np.zeros(N, dtype=int)
+    np.cumsum(z + 1, out=offsets[1:])
+    if not clocklike:
+        deltas = rng.exponential(scale=1/N, size=offsets[-1])
+    else:
+        deltas = np.repeat(rng.exponential(scale=1/N, size=N-1), z + 1)
+    
+    alpha[branching] = 1.0
+    if not circular:
+        y = np.where(branching, x, other + (other >= x))
+    else:
+        y = np.empty(N-1, dtype=int)
+        successors = [0] * N
+        for i, x_i in enumerate(x.tolist()):
+            y[i] = successors[x_i]
+            successors[x_i] = i + 1
+            successors[i+1] = y[i]
+    
+    return x, y, alpha, deltas, offsets
+
+
+def _history_from_events(x, y, alpha, deltas, offsets):
+    """History from the output of _random_events() (without copies of the
+    arrays)."""
+    
+    return History(x, y, np.arange(1, len(x) + 1), alpha, deltas, offsets)
+
+
+def _random_history_bulk(N, rng, branching_prob, circular, clocklike):
+    
+    return _history_from_events(*_random_events(N, rng, branching_prob,
+                                                circular, clocklike))
+
+
+def _distance_matrices(x, y, alpha, deltas, offsets, out):
+    """Build the distance matrices of k histories with N items in lockstep.
+    
+    The events with the same z are applied to all matrices at once, in the
+    same order of operations as in _distance_matrix(). This is preferable to
+    building the matrices one by one if N is small.
+    
+    Parameters
+    ----------
+    x, y, alpha : 2-dimensional numpy arrays
+        The parameters of the events of shape (k, N-1) as returned by
+        _random_events().
+    deltas : 2-dimensional numpy array
+        The concatenated distance increments of shape (k, offsets[-1]).
+    offsets : 1-dimensional numpy array
+        The offsets of the increments of the events (the same for all
+        histories).
+    out : 3-dimensional numpy array
+        Array of shape (k, N, N) in which the matrices are built.
+    """
+    
+    k, N = out.shape[0], out.shape[1]
+    D = out
+    D[:, 0, 0] = 0.0
+    b = np.arange(k)
+    
+    for z in range(1, N):
+        
+        x_z, y_z, alpha_z = x[:, z-1], y[:, z-1], alpha[:, z-1]
+        duplication = np.array([_is_duplication(x_i, y_i, alpha_i)
+                                for x_i, y_i, alpha_i
+                                in zip(x_z, y_z, alpha_z)], dtype=bool)
+        
+        rows_x, rows_y = D[b, x_z, :z], D[b, y_z, :z]
+        d_xy = rows_x[b, y_z]
+        
+        new = alpha_z[:, None] * rows_x + (1 - alpha_z)[:, None] * rows_y
+        new[b, x_z] = (1 - alpha_z) * d_xy
+        new[b, y_z] = alpha_z * d_xy
+        new[duplication] = 0.0
+        
+        D[:, z, :z] = new
+        D[:, :z, z] = new
+        D[:, z, z] = 0.0
+        
+        # distance increment, i.e., independent evolution after event
+        delta = deltas[:, offsets[z-1]:offsets[z]]
+        D[:, :z+1, :z+1] += delta[:, :, None] + delta[:, None, :]
+        diagonal = np.arange(z+1)
+        D[:, diagonal, diagonal] = 0.0
 
 
-def simulate(N, branching_prob=0.0, circular=False, clocklike=False):
+def simulate(N, branching_prob=0.0, circular=False, clocklike=False,
+             condensed=False, dtype=None, out=None):
     """Simulate a random type R matrix.
     
     Parameters
@@ -265,6 +651,16 @@ def simulate(N, branching_prob=0.0, circular=False, clocklike=False):
         increments) and only varies between iteration. The default is False,
         in which case the increments are also drawn independently for the
         items within an iteration.
+    condensed : bool, optional
+        If True, the distance matrix is stored as a condensed vector. The
+        default is False.
+    dtype : numpy dtype, optional
+        Data type of the distances. The default is None, i.e., float64
+        (float32 is not suited for the recognition, see Scenario).
+    out : str or numpy array, optional
+        A filename, in which case the distance matrix is built into a
+        np.memmap of this file, or an array in which the matrix is built. The
+        default is None.
         
     Returns
     -------
@@ -279,16 +675,152 @@ def simulate(N, branching_prob=0.0, circular=False, clocklike=False):
     
     return Scenario(random_history(N, branching_prob=branching_prob,
                                    circular=circular,
-                                   clocklike=clocklike))
+                                   clocklike=clocklike),
+                    condensed=condensed, dtype=dtype, out=out)
 
 
-def scenario_from_history(history, stop_after=False):
+def simulate_batch(k, N, branching_prob=0.0, circular=False, clocklike=False,
+                   seed=None, condensed=False, dtype=None):
+    """Simulate a batch of random type R matrices.
+    
+    Every scenario draws its random numbers from its own generator, which is
+    seeded with the child i of numpy.random.SeedSequence(seed). Hence, each
+    scenario can be reproduced individually from the seed and its index (see
+    scenario_from_seed()), independently of the others. The children are
+    derived from the entropy and the spawn key of the SeedSequence, i.e.,
+    independently of children spawned from it before.
+    
+    Parameters
+    ----------
+    k : int
+        Number of scenarios.
+    N : int
+        Number of items.
+    branching_prob : float, optional
+        Probability that an event is a pure branching event. The default is
+        0.0, i.e., pure branching events are disabled.
+    circular : bool, optional
+        If set to True, the resulting distance matrices are guaranteed to be
+        circular type R matrices. The default is False.
+    clocklike : bool, optional
+        If set to True, the distance increment is equal for all items within
+        each iteration. The default is False.
+    seed : int or numpy.random.SeedSequence, optional
+        Seed of the batch. The default is None, in which case fresh entropy
+        is used.
+    condensed : bool, optional
+        If True, the matrices are returned as condensed vectors, i.e., as an
+        array of shape (k, N*(N-1)/2). The default is False.
+    dtype : numpy dtype, optional
+        Data type of the distances. The default is None, i.e., float64. The
+        matrices are identical to those of scenario_from_seed() also for
+        float32, which, however, is not suited for the recognition (see
+        Scenario).
+        
+    Returns
+    -------
+    tuple of numpy array, list, and numpy.random.SeedSequence
+        The distance matrices of shape (k, N, N) (or their condensed vectors),
+        the histories of the scenarios, and the SeedSequence of the batch,
+        which can be passed to scenario_from_seed() (its attribute 'entropy'
+        holds the fresh entropy if no seed was given).
+    
+    See Also
+    --------
+    scenario_from_seed()
+    """
+    
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    
+    shape = (k, Condensed.condensed_size(N)) if condensed else (k, N, N)
+    D = np.empty(shape, dtype=dtype or np.float64)
+    events = [_random_events(N, np.random.default_rng(child), branching_prob,
+                             circular, clocklike)
+              for child in (_batch_child(seed, i) for i in range(k))]
+    histories = [_history_from_events(*e) for e in events]
+    
+    # for small N, the per-event overhead dominates the matrix build (the
+    # lockstep build is in float64, other types are rounded as in
+    # _distance_matrix)
+    if N <= 128 and D.dtype == np.float64:
+        upper = np.triu_indices(N, k=1)
+        chunk_size = max(1, 2**22 // (N * N))
+        for c0 in range(0, k, chunk_size):
+            chunk = events[c0:c0+chunk_size]
+            x, y, alpha, deltas = (np.stack([e[i] for e in chunk])
+                                   for i in range(4))
+            matrices = np.empty((len(chunk), N, N))
+            _distance_matrices(x, y, alpha, deltas, chunk[0][4], matrices)
+            D[c0:c0+len(chunk)] = (matrices[:, upper[0], upper[1]]
+                                   if condensed else matrices)
+    else:
+        for i, history in enumerate(histories):
+            _distance_matrix(history, N, out=D[i], condensed=condensed)
+    
+    return D, histories, seed
+
+
+def _batch_child(seed, index):
+    """Child 'index' of a SeedSequence, the same as the one returned by
+    seed.spawn() if no children were spawned before."""
+    
+    return np.random.SeedSequence(seed.entropy,
+                                  spawn_key=seed.spawn_key + (index,),
+                                  pool_size=seed.pool_size)
+
+
+def scenario_from_seed(seed, index, N, branching_prob=0.0, circular=False,
+                       clocklike=False, condensed=False, dtype=None):
+    """Rebuild a single scenario of simulate_batch().
+    
+    Parameters
+    ----------
+    seed : int or numpy.random.SeedSequence
+        Seed of the batch, e.g., the SeedSequence returned by
+        simulate_batch() (or its entropy). Only the entropy, the spawn key,
+        and the pool size of a SeedSequence are used, i.e., children spawned
+        from it before do not matter.
+    index : int
+        Index of the scenario in the batch.
+    N, branching_prob, circular, clocklike, condensed, dtype
+        The parameters of the batch.
+        
+    Returns
+    -------
+    Scenario
+        Comprises the history of merge and branching events as well as the
+        distance matrix.
+    """
+    
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    
+    child = _batch_child(seed, index)
+    
+    return Scenario(random_history(N, branching_prob=branching_prob,
+                                   circular=circular, clocklike=clocklike,
+                                   rng=np.random.default_rng(child)),
+                    condensed=condensed, dtype=dtype)
+
+
+def scenario_from_history(history, stop_after=False, condensed=False,
+                          dtype=None, out=None):
     """Generate a type R matrix from a list of merge and branching events.
     
     Parameters
     ----------
-    history : list of tuples
+    history : History or list of tuples
         The history of merge and branching events.
+    condensed : bool, optional
+        If True, the distance matrix is stored as a condensed vector. The
+        default is False.
+    dtype : numpy dtype, optional
+        Data type of the distances. The default is None, i.e., float64.
+    out : str or numpy array, optional
+        A filename, in which case the distance matrix is built into a
+        np.memmap of this file, or an array in which the matrix is built. The
+        default is None.
         
     Returns
     -------
@@ -304,16 +836,28 @@ def scenario_from_history(history, stop_after=False):
     else:
         raise RuntimeError(f'not enough events to simulate {stop_after} items')
     
-    return Scenario(history[:N-1])
+    return Scenario(history[:N-1], condensed=condensed, dtype=dtype, out=out)
 
 
-def load(filename, stop_after=False):
+def load(filename, stop_after=False, condensed=False, dtype=None, out=None):
     """Generate an event history from a file and generate the type R matrix.
     
+    The file may be in the text or in the binary format (see tools.FileIO);
+    the latter is detected automatically and memory-mapped.
+    
     Parameters
     ----------
     filename : str
         Path and filename.
+    condensed : bool, optional
+        If True, the distance matrix is stored as a condensed vector. The
+        default is False.
+    dtype : numpy dtype, optional
+        Data type of the distances. The default is None, i.e., float64.
+    out : str or numpy array, optional
+        A filename, in which case the distance matrix is built into a
+        np.memmap of this file, or an array in which the matrix is built. The
+        default is None.
         
     Returns
     -------
@@ -322,8 +866,9 @@ def load(filename, stop_after=False):
         distance matrix.
     """
     
-    return scenario_from_history(FileIO.parse_history(filename),
-                                 stop_after=stop_after)
+    return scenario_from_history(FileIO.read_history(filename),
+                                 stop_after=stop_after, condensed=condensed,
+                                 dtype=dtype, out=out)
 
 
 def R_metric_on_4(p, q, a, dx=0, dy=0, dz=0, du=0):
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""Append-only archive of many scenarios in a single file.
+
+An archive consists of a data file and an index file (the data filename with
+the suffix '.idx'). Each record in the data file holds a history in the binary
+format of tools.FileIO, optionally followed by the distance matrix as a
+condensed float64 vector (see tools.Condensed) and an outcome, e.g. of the
+recognition, as a JSON object. The index holds the byte offset and size of
+each record, and the id of a record is its position in the index. Hence, a
+record is found in O(1).
+
+Appending locks the data file (flock on POSIX systems), so that several
+processes can append to the same archive. A record is visible to readers only
+once its index entry has been written, i.e., after its data is complete.
+"""
+
+import io
+import json
+import os
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:     # no locking on non-POSIX systems
+    fcntl = None
+
+from erdbeermet.tools.Condensed import to_condensed
+from erdbeermet.tools.FileIO import (read_history_binary_at,
+                                     write_history_binary_to)
+
+
+__author__ = 'David Schaller'
+
+
+# record header (all numbers little-endian): magic, size of the history in
+# bytes, number of entries of the condensed matrix (0 if not stored), and size
+# of the outcome in bytes (0 if not stored); the parts are padded to 8 bytes
+_RECORD_MAGIC = b'ERDBREC1'
+_RECORD_HEADER = np.dtype([('magic', 'S8'), ('history_size', '<u8'),
+                           ('matrix_size', '<u8'), ('outcome_size', '<u8')])
+
+# index entry: byte offset and size of the record in the data file
+_INDEX_ENTRY = np.dtype([('offset', '<u8'), ('size', '<u8')])
+
+
+def index_filename(filename):
+    """Filename of the index of an archive."""
+    
+    return str(filename) + '.idx'
+
+
+def _padding(size):
+    
+    return b'\0' * (-size % 8)
+
+
+def _record_bytes(history, D, outcome):
+    
+    buffer = io.BytesIO()
+    buffer.seek(_RECORD_HEADER.itemsize)
+    write_history_binary_to(buffer, history)
+    history_size = buffer.tell() - _RECORD_HEADER.itemsize
+    
+    matrix_size = 0
+    if D is not None:
+        D = np.asarray(D)
+        d = D if D.ndim == 1 else to_condensed(D)
+        d = np.asarray(d, dtype='<f8')
+        matrix_size = len(d)
+        buffer.write(d.tobytes())
+    
+    outcome_bytes = b''
+    if outcome is not None:
+        outcome_bytes = json.dumps(outcome).encode('utf-8')
+        buffer.write(outcome_bytes + _padding(len(outcome_bytes)))
+    
+    header = np.array((_RECORD_MAGIC, history_size, matrix_size,
+                       len(outcome_bytes)), dtype=_RECORD_HEADER)
+    buffer.seek(0)
+    buffer.write(header.tobytes())
+    
+    return buffer.getvalue()
+
+
+def append_scenario(filename, history, D=None, outcome=None):
+    """Append a scenario to an archive (which is created if necessary).
+    
+    Parameters
+    ----------
+    filename : str
+        Path and filename of the data file.
+    history : History or list of tuples
+        The history of merge and branching events.
+    D : numpy array, optional
+        The distance matrix (or its condensed vector). The default is None,
+        in which case no matrix is stored.
+    outcome : dict, optional
+        JSON-serializable outcome, e.g., of the recognition. The default is
+        None, in which case no outcome is stored.
+    
+    Returns
+    -------
+    int
+        The id of the new record.
+    """
+    
+    record = _record_bytes(history, D, outcome)
+    
+    with open(filename, 'ab') as f:
+        
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        
+        try:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(record)
+            f.flush()
+            
+            with open(index_filename(filename), 'ab') as index:
+                size = index.seek(0, os.SEEK_END)
+                record_id = size // _INDEX_ENTRY.itemsize
+                entry = np.array((offset, len(record)), dtype=_INDEX_ENTRY)
+                index.write(entry.tobytes())
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    
+    return record_id
+
+
+def archive_size(filename):
+    """Number of records in an archive."""
+    
+    if not os.path.exists(index_filename(filename)):
+        return 0
+    
+    return os.path.getsize(index_filename(filename)) // _INDEX_ENTRY.itemsize
+
+
+def _read_record(filename, offset, mmap):
+    
+    header = np.fromfile(filename, dtype=_RECORD_HEADER, count=1,
+                         offset=offset)
+    
+    if len(header) == 0 or header['magic'][0] != _RECORD_MAGIC:
+        raise ValueError(f'{filename}: no archive record at offset {offset}')
+    
+    matrix_size = int(header['matrix_size'][0])
+    outcome_size = int(header['outcome_size'][0])
+    
+    history, offset = read_history_binary_at(
+        filename, offset + _RECORD_HEADER.itemsize, mmap=mmap)
+    
+    D = None
+    if matrix_size:
+        if mmap:
+            D = np.memmap(filename, dtype='<f8', mode='r', offset=offset,
+                          shape=(matrix_size,))
+        else:
+            D = np.fromfile(filename, dtype='<f8', count=matrix_size,
+                            offset=offset)
+        offset += 8 * matrix_size
+    
+    outcome = None
+    if outcome_size:
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            outcome = json.loads(f.read(outcome_size).decode('utf-8'))
+    
+    return history, D, outcome
+
+
+def read_scenario(filename, record_id, mmap=True):
+    """Record of an archive by its id.
+    
+    Parameters
+    ----------
+    filename : str
+        Path and filename of the data file.
+    record_id : int
+        Id of the record, i.e., the return value of append_scenario().
+    mmap : bool, optional
+        If True, the history and the matrix are memory-mapped views of the
+        data file. The default is True.
+    
+    Returns
+    -------
+    tuple
+        The History, the condensed distance matrix (or None), and the
+        outcome (or None).
+    """
+    
+    if not 0 <= record_id < archive_size(filename):
+        raise IndexError(f'{filename}: no record with id {record_id}')
+    
+    entry = np.fromfile(index_filename(filename), dtype=_INDEX_ENTRY,
+                        count=1, offset=record_id * _INDEX_ENTRY.itemsize)
+    
+    return _read_record(filename, int(entry['offset'][0]), mmap)
+
+
+def iter_archive(filename, mmap=False, chunk_size=4096):
+    """Generator for the records (id, history, D, outcome) of an archive.
+    
+    The index is read in chunks and the records one by one, i.e., the
+    archive is never held in memory as a whole. Records appended during the
+    iteration are included.
+    """
+    
+    record_id = 0
+    
+    while record_id < archive_size(filename):
+        
+        entries = np.fromfile(index_filename(filename), dtype=_INDEX_ENTRY,
+                              count=chunk_size,
+                              offset=record_id * _INDEX_ENTRY.itemsize)
+        
+        for offset in entries['offset'].tolist():
+            yield (record_id, *_read_record(filename, offset, mmap))
+            record_id += 1
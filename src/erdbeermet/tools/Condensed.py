@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""Condensed storage of symmetric distance matrices.
+
+A symmetric n x n matrix with zero diagonal is stored as the vector of its
+upper triangle in row-major order, i.e., in the format of
+scipy.spatial.distance.squareform. The entry D[i,j] with i < j is at
+position n*i - i*(i+1)//2 + (j - i - 1).
+"""
+
+import numpy as np
+
+
+__author__ = 'David Schaller'
+
+
+def condensed_size(n):
+    """Length of the condensed vector of an n x n matrix."""
+    
+    return n * (n - 1) // 2
+
+
+def matrix_size(d):
+    """Number of rows of the matrix represented by a condensed vector d (or
+    of a square matrix d)."""
+    
+    if d.ndim == 2:
+        return d.shape[0]
+    
+    n = int(round((1 + np.sqrt(1 + 8 * d.shape[0])) / 2))
+    
+    if condensed_size(n) != d.shape[0]:
+        raise ValueError(f'invalid length {d.shape[0]} of condensed vector')
+    
+    return n
+
+
+def is_condensed(D):
+    """Whether D is a condensed vector (instead of a square matrix)."""
+    
+    return D.ndim == 1
+
+
+def condensed_index(n, i, j):
+    """Position of D[i,j] (i < j, also as arrays) in the condensed vector."""
+    
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+def row_slice(n, i, j0=None, j1=None):
+    """Slice of the condensed vector containing D[i, j0:j1] (i < j0)."""
+    
+    j0 = i + 1 if j0 is None else j0
+    j1 = n if j1 is None else j1
+    start = condensed_index(n, i, j0)
+    
+    return slice(start, start + (j1 - j0))
+
+
+def to_condensed(D, dtype=None, out=None):
+    """Condensed vector of a symmetric matrix (the upper triangle is used).
+    
+    Parameters
+    ----------
+    D : 2-dimensional numpy array
+        Symmetric distance matrix.
+    dtype : numpy dtype, optional
+        Data type of the result. The default is None, i.e., that of D.
+    out : 1-dimensional numpy array, optional
+        Array in which the result is written.
+    
+    Returns
+    -------
+    1-dimensional numpy array
+    """
+    
+    n = D.shape[0]
+    
+    if out is None:
+        out = np.empty(condensed_size(n), dtype=dtype or D.dtype)
+    
+    for i in range(n - 1):
+        out[row_slice(n, i)] = D[i, i+1:]
+    
+    return out
+
+
+def to_matrix(d, dtype=None, out=None, block_size=1024):
+    """Symmetric matrix from a condensed vector.
+    
+    The matrix is written in square tiles, so that d and out may also be
+    memory-mapped arrays.
+    
+    Parameters
+    ----------
+    d : 1-dimensional numpy array
+        Condensed vector.
+    dtype : numpy dtype, optional
+        Data type of the result. The default is None, i.e., that of d.
+    out : 2-dimensional numpy array, optional
+        Array in which the result is written.
+    block_size : int, optional
+        Size of the tiles. The default is 1024.
+    
+    Returns
+    -------
+    2-dimensional numpy array
+    """
+    
+    n = matrix_size(d)
+    
+    if out is None:
+        out = np.empty((n, n), dtype=dtype or d.dtype)
+    
+    for i0 in range(0, n, block_size):
+        i1 = min(i0 + block_size, n)
+        for j0 in range(i0, n, block_size):
+            j1 = min(j0 + block_size, n)
+            block = matrix_block(d, i0, i1, j0, j1)
+            out[i0:i1, j0:j1] = block
+            if j0 != i0:
+                out[j0:j1, i0:i1] = block.T
+    
+    return out
+
+
+def matrix_block(D, i0, i1, j0, j1):
+    """The block D[i0:i1, j0:j1] of a square matrix or a condensed vector.
+    
+    For a square matrix, the block is a view; otherwise it is gathered from
+    the condensed vector.
+    """
+    
+    if D.ndim == 2:
+        return D[i0:i1, j0:j1]
+    
+    n = matrix_size(D)
+    i, j = np.meshgrid(np.arange(i0, i1), np.arange(j0, j1), indexing='ij')
+    off_diagonal = i != j
+    low = np.minimum(i, j)[off_diagonal]
+    high = np.maximum(i, j)[off_diagonal]
+    
+    block = np.zeros(i.shape, dtype=D.dtype)
+    block[off_diagonal] = D[condensed_index(n, low, high)]
+    
+    return block
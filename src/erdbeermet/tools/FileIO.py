@@ -1,6 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import json
+import os
 import re
+import warnings
+
+import numpy as np
+
+from erdbeermet.tools.Condensed import to_condensed
+from erdbeermet.tools.History import History
 
 
 def write_history(filename, history):
@@ -18,35 +26,402 @@ def write_history(filename, history):
                 f.write(f"\n({x}, {y}: {z}) {alpha}; {delta_str}")
                 
 
-def _split_floats(floats):
+_EVENT_REGEX = re.compile(r"\(\s*(\d+)\s*,\s*(\d+)\s*:\s*(\d+)\s*\)\s*;?"
+                          r"\s*([^;\s]+)\s*;\s*\[([^\]]*)\]$")
+
+
+def _parse_event(line, filename, line_number):
+    
+    match = _EVENT_REGEX.match(line)
+    
+    if not match:
+        raise ValueError(f'{filename}, line {line_number}: malformed event '
+                         f'{line[:80]!r}')
     
-    return [float(item) for item in floats.split(',')]
+    x, y, z = (int(match.group(i)) for i in (1, 2, 3))
+    
+    try:
+        alpha = float(match.group(4))
+        # parsed by numpy in one pass (without a list of strings); numpy only
+        # warns about unparsable data, which is raised as DeprecationWarning
+        # (numpy 1.x) or ValueError (numpy 2.x) by the filter
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            delta = np.fromstring(match.group(5), dtype=np.float64, sep=',')
+    except (ValueError, DeprecationWarning) as e:
+        raise ValueError(f'{filename}, line {line_number}: {e}') from None
+    
+    if len(delta) != z + 1:
+        raise ValueError(f'{filename}, line {line_number}: {len(delta)} '
+                         f'distance increments for z={z} (expected {z+1})')
+    
+    return x, y, z, alpha, delta
 
 
-def parse_history(filename):
+def iter_history(filename):
+    """Generator for the events (x, y, z, alpha, delta) in a history file.
+    
+    The file is read line by line, i.e., it is never held in memory as a
+    whole. Empty lines are skipped.
     
-    event_regex = re.compile(r"\((\d+)\,\s*(\d+)\:\s*(\d+)\)\;?\s*(\d+\.?\d*e?-?\d+)\;\s*\[(?P<delta>(\s*\d+\.?\d*e?-?\d+,?)+)\]")
+    Raises
+    ------
+    ValueError
+        If a line is not a valid event.
+    """
     
     with open(filename, 'r') as f:
+    
+        for line_number, line in enumerate(f, start=1):
         
-        lines = f.readlines()
-      
-    history = []
-    for line in lines:
+            line = line.strip()
+            
+            if line:
+                yield _parse_event(line, filename, line_number)
+
+
+def parse_history(filename):
+    """History in a file written by write_history().
+    
+    Returns
+    -------
+    History
+    
+    Raises
+    ------
+    ValueError
+        If a line is not a valid event.
+    """
+    
+    return History.from_events(iter_history(filename))
+
+
+# binary history format (all numbers little-endian):
+#   bytes 0-7     magic b'ERDBHIST'
+#   bytes 8-15    format version (uint64)
+#   bytes 16-23   number of events n (uint64)
+#   bytes 24-31   total number of distance increments m (uint64)
+#   then          deltas (float64, m), x, y, z (int64, n each), alpha
+#                 (float64, n) and offsets (int64, n+1), i.e., the arrays of
+#                 a History
+# The deltas come first so that the file can be written in one pass from a
+# stream of events; the header is completed at the end.
+_BINARY_MAGIC = b'ERDBHIST'
+_BINARY_VERSION = 1
+_BINARY_HEADER = np.dtype([('magic', 'S8'), ('version', '<u8'),
+                           ('n', '<u8'), ('m', '<u8')])
+
+
+def is_binary_history(filename):
+    """Whether a file is a history in the binary format."""
+    
+    with open(filename, 'rb') as f:
+    
+        return f.read(len(_BINARY_MAGIC)) == _BINARY_MAGIC
+
+
+def write_history_binary(filename, history):
+    """Write a history (or an iterable of events) in the binary format.
+    
+    The distance increments are written event by event, so that e.g. the
+    generator iter_history() can be converted without loading the whole
+    history.
+    """
+    
+    with open(filename, 'wb') as f:
+    
+        write_history_binary_to(f, history)
+
+
+def write_history_binary_to(f, history):
+    """Write a history in the binary format at the current position of a
+    seekable binary file object, e.g., an open file or an io.BytesIO.
+    
+    The position afterwards is the end of the written history.
+    """
+    
+    start = f.tell()
+    x, y, z, alpha, offsets = [], [], [], [], [0]
+    
+    f.seek(start + _BINARY_HEADER.itemsize)
+    
+    for x_i, y_i, z_i, alpha_i, delta in history:
+        x.append(x_i)
+        y.append(y_i)
+        z.append(z_i)
+        alpha.append(alpha_i)
+        delta = np.asarray(delta, dtype='<f8')
+        offsets.append(offsets[-1] + len(delta))
+        f.write(delta.tobytes())
+    
+    for array, dtype in ((x, '<i8'), (y, '<i8'), (z, '<i8'),
+                         (alpha, '<f8'), (offsets, '<i8')):
+        f.write(np.asarray(array, dtype=dtype).tobytes())
+    
+    end = f.tell()
+    header = np.array((_BINARY_MAGIC, _BINARY_VERSION, len(x), offsets[-1]),
+                      dtype=_BINARY_HEADER)
+    f.seek(start)
+    f.write(header.tobytes())
+    f.seek(end)
+
+
+def read_history_binary(filename, mmap=True):
+    """History in a file written by write_history_binary().
+    
+    Parameters
+    ----------
+    filename : str
+        Path and filename.
+    mmap : bool, optional
+        If True, the arrays of the history are read-only memory-mapped views
+        of the file, i.e., nothing is read before it is accessed. The default
+        is True.
+    
+    Returns
+    -------
+    History
+    
+    Raises
+    ------
+    ValueError
+        If the file is not a history in the binary format or is truncated.
+    """
+    
+    return read_history_binary_at(filename, 0, mmap=mmap)[0]
+
+
+def read_history_binary_at(filename, offset, mmap=True):
+    """History in the binary format that starts at a byte offset of a file,
+    e.g., inside an archive (see tools.Archive).
+    
+    Parameters
+    ----------
+    filename : str
+        Path and filename.
+    offset : int
+        Byte offset of the history in the file.
+    mmap : bool, optional
+        If True, the arrays of the history are read-only memory-mapped views
+        of the file. The default is True.
+    
+    Returns
+    -------
+    tuple
+        The History and the byte offset of its end.
+    
+    Raises
+    ------
+    ValueError
+        If there is no history in the binary format at the offset or it is
+        truncated.
+    """
+    
+    header = np.fromfile(filename, dtype=_BINARY_HEADER, count=1,
+                         offset=offset)
+    
+    if len(header) == 0 or header['magic'][0] != _BINARY_MAGIC:
+        raise ValueError(f'{filename} is not a binary history file')
+    if header['version'][0] != _BINARY_VERSION:
+        raise ValueError(f'{filename}: unsupported version '
+                         f'{header["version"][0]}')
+    
+    n, m = int(header['n'][0]), int(header['m'][0])
+    layout = [('deltas', '<f8', m), ('x', '<i8', n), ('y', '<i8', n),
+              ('z', '<i8', n), ('alpha', '<f8', n), ('offsets', '<i8', n+1)]
+    
+    offset += _BINARY_HEADER.itemsize
+    end = offset + 8 * (m + 4 * n + n + 1)
+    if os.path.getsize(filename) < end:
+        raise ValueError(f'{filename}: truncated binary history file')
+    
+    arrays = {}
+    for name, dtype, count in layout:
+        if mmap and count:
+            arrays[name] = np.memmap(filename, dtype=dtype, mode='r',
+                                     offset=offset, shape=(count,))
+        else:
+            arrays[name] = np.fromfile(filename, dtype=dtype, count=count,
+                                       offset=offset)
+        offset += 8 * count
+    
+    return History(**arrays), end
+
+
+def read_history(filename, mmap=True):
+    """History in a file in the text or the binary format (detected
+    automatically)."""
+    
+    if is_binary_history(filename):
+        return read_history_binary(filename, mmap=mmap)
+    
+    return parse_history(filename)
+
+
+def convert_history(filename, binary_filename):
+    """Convert a text history file into the binary format (streaming)."""
+    
+    write_history_binary(binary_filename, iter_history(filename))
+
+
+# binary recognition tree format (all numbers little-endian):
+#   bytes 0-7     magic b'ERDBTREE'
+#   bytes 8-15    format version (uint64)
+#   bytes 16-23   number of nodes k (uint64)
+#   bytes 24-31   total number of stored matrix entries m (uint64)
+#   bytes 32-39   size of the JSON metadata in bytes (uint64)
+#   then          matrices (float64, m; the condensed matrices of the nodes
+#                 that store one, concatenated), the node arrays in
+#                 _TREE_ARRAYS (int64/float64, k each, matrix_offsets k+1),
+#                 and the JSON metadata (info strings, V of the root, format
+#                 of the matrices)
+# The nodes are in preorder, i.e., the subtree of node i consists of the nodes
+# i, ..., i + size[i] - 1. The matrix of node i is
+# matrices[matrix_offsets[i]:matrix_offsets[i+1]] (empty if not stored).
+_TREE_MAGIC = b'ERDBTREE'
+_TREE_VERSION = 1
+_TREE_HEADER = np.dtype([('magic', 'S8'), ('version', '<u8'),
+                         ('nodes', '<u8'), ('m', '<u8'),
+                         ('json_size', '<u8')])
+_TREE_ARRAYS = [('size', '<i8'), ('parent', '<i8'), ('n', '<i8'),
+                ('x', '<i8'), ('y', '<i8'), ('z', '<i8'), ('alpha', '<f8'),
+                ('delta_x', '<f8'), ('delta_y', '<f8'),
+                ('valid_ways', '<i8'), ('info_code', '<i8'),
+                ('matrix_offsets', '<i8')]
+
+
+def write_recognition_binary(filename, tree, matrices=True):
+    """Write a recognition tree in the binary format.
+    
+    The matrices are written node by node during a single preorder
+    traversal, i.e., they are never collected in memory.
+    
+    Parameters
+    ----------
+    filename : str
+        Path and filename.
+    tree : Tree
+        The recognition tree.
+    matrices : bool, optional
+        If True, the matrices of the nodes that store one (see
+        TreeNode.stores_matrix()) are written as well. The default is True.
+    """
+    
+    arrays = {name: [] for name, _ in _TREE_ARRAYS}
+    arrays['matrix_offsets'].append(0)
+    index = {}
+    info_strings = {}
+    m = 0
+    
+    with open(filename, 'wb') as f:
         
-        match = event_regex.match(line.strip())
+        f.seek(_TREE_HEADER.itemsize)
         
-        if match:
-            
-            x = int(match.group(1))
-            y = int(match.group(2))
-            z = int(match.group(3))
-            alpha = float(match.group(4))
-            delta = _split_floats(match.group('delta'))
-            
-        history.append((x, y, z, alpha, delta))
+        for i, v in enumerate(tree.preorder()):
+            index[id(v)] = i
+            arrays['parent'].append(-1 if v.parent is None
+                                    else index[id(v.parent)])
+            arrays['n'].append(v.n)
+            x, y, z, alpha = v.R_step if v.R_step else (-1, -1, -1, np.nan)
+            delta_x, delta_y = v.deltas if v.deltas else (np.nan, np.nan)
+            for name, value in (('x', x), ('y', y), ('z', z),
+                                ('alpha', alpha), ('delta_x', delta_x),
+                                ('delta_y', delta_y),
+                                ('valid_ways', v.valid_ways),
+                                ('info_code', v.info_code)):
+                arrays[name].append(value)
+            if v.info_code:
+                info_strings[v.info_code] = v.info
             
-    return history
+            if matrices and v.stores_matrix():
+                d = v._D if v._D.ndim == 1 else to_condensed(v._D)
+                f.write(np.asarray(d, dtype='<f8').tobytes())
+                m += len(d)
+            arrays['matrix_offsets'].append(m)
+        
+        # subtree sizes (the parent of a node precedes it in preorder)
+        parent = arrays['parent']
+        size = np.ones(len(parent), dtype=int)
+        for i in range(len(parent) - 1, 0, -1):
+            size[parent[i]] += size[i]
+        arrays['size'] = size
+        
+        for name, dtype in _TREE_ARRAYS:
+            f.write(np.asarray(arrays[name], dtype=dtype).tobytes())
+        
+        root = tree.root
+        meta = json.dumps({
+            'info_strings': {str(code): info
+                             for code, info in info_strings.items()},
+            'V': list(root.V) if root else [],
+            'condensed': bool(root and root.stores_matrix()
+                              and root._D.ndim == 1),
+            }).encode('utf-8')
+        f.write(meta)
+        
+        header = np.array((_TREE_MAGIC, _TREE_VERSION, len(parent), m,
+                           len(meta)), dtype=_TREE_HEADER)
+        f.seek(0)
+        f.write(header.tobytes())
+
+
+def read_recognition_binary(filename, mmap=True):
+    """Node arrays and metadata of a recognition tree in the binary format.
+    
+    Parameters
+    ----------
+    filename : str
+        Path and filename.
+    mmap : bool, optional
+        If True, the arrays are read-only memory-mapped views of the file,
+        i.e., nothing is read before it is accessed. The default is True.
+    
+    Returns
+    -------
+    tuple of dict and dict
+        The arrays (see _TREE_ARRAYS, and 'matrices') and the metadata.
+    
+    Raises
+    ------
+    ValueError
+        If the file is not a recognition tree in the binary format.
+    """
+    
+    header = np.fromfile(filename, dtype=_TREE_HEADER, count=1)
+    
+    if len(header) == 0 or header['magic'][0] != _TREE_MAGIC:
+        raise ValueError(f'{filename} is not a binary recognition tree file')
+    if header['version'][0] != _TREE_VERSION:
+        raise ValueError(f'{filename}: unsupported version '
+                         f'{header["version"][0]}')
+    
+    k, m = int(header['nodes'][0]), int(header['m'][0])
+    layout = [('matrices', '<f8', m)]
+    layout.extend((name, dtype, k + 1 if name == 'matrix_offsets' else k)
+                  for name, dtype in _TREE_ARRAYS)
+    
+    offset = _TREE_HEADER.itemsize
+    end = offset + 8 * sum(count for _, _, count in layout)
+    if os.path.getsize(filename) < end + int(header['json_size'][0]):
+        raise ValueError(f'{filename}: truncated binary recognition tree file')
+    
+    arrays = {}
+    for name, dtype, count in layout:
+        if mmap and count:
+            arrays[name] = np.memmap(filename, dtype=dtype, mode='r',
+                                     offset=offset, shape=(count,))
+        else:
+            arrays[name] = np.fromfile(filename, dtype=dtype, count=count,
+                                       offset=offset)
+        offset += 8 * count
+    
+    with open(filename, 'rb') as f:
+        f.seek(end)
+        meta = json.loads(f.read(int(header['json_size'][0])).decode('utf-8'))
+    meta['info_strings'] = {int(code): info
+                            for code, info in meta['info_strings'].items()}
+    
+    return arrays, meta
 
 
 def _write_matrix(f, V, D):
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""Compact storage of histories of merge and branching events.
+
+The parameters x, y, z and alpha of the events are stored in flat arrays, and
+the distance increments of all events are concatenated into a single buffer
+in which the increments of event i are deltas[offsets[i]:offsets[i+1]]
+(CSR-style). Iteration yields the usual tuples (x, y, z, alpha, delta).
+"""
+
+import numpy as np
+
+
+__author__ = 'David Schaller'
+
+
+class History:
+    """History of merge and branching events.
+    
+    Attributes
+    ----------
+    x, y, z : 1-dimensional numpy arrays of int
+        The items of the events (x, y: z)alpha.
+    alpha : 1-dimensional numpy array of float
+        The alphas of the events (1.0 for pure branching events).
+    deltas : 1-dimensional numpy array of float
+        The concatenated distance increments of all events.
+    offsets : 1-dimensional numpy array of int
+        The increments of event i are deltas[offsets[i]:offsets[i+1]]. Of
+        length len(history) + 1; offsets[0] need not be 0 if the history is a
+        slice of another history.
+    
+    Slicing a History returns a History that shares the arrays with the
+    original. Pickling only stores the part of the delta buffer that belongs
+    to the history.
+    """
+    
+    def __init__(self, x, y, z, alpha, deltas, offsets):
+        
+        self.x = np.asarray(x, dtype=int)
+        self.y = np.asarray(y, dtype=int)
+        self.z = np.asarray(z, dtype=int)
+        self.alpha = np.asarray(alpha, dtype=np.float64)
+        self.deltas = np.asarray(deltas, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=int)
+        
+        if not (len(self.x) == len(self.y) == len(self.z) == len(self.alpha)
+                == len(self.offsets) - 1):
+            raise ValueError('inconsistent lengths of the event arrays')
+    
+    
+    @classmethod
+    def from_events(cls, events):
+        """History from an iterable of tuples (x, y, z, alpha, delta)."""
+        
+        x, y, z, alpha, deltas = [], [], [], [], []
+        
+        for x_i, y_i, z_i, alpha_i, delta in events:
+            x.append(x_i)
+            y.append(y_i)
+            z.append(z_i)
+            alpha.append(alpha_i)
+            deltas.append(np.asarray(delta, dtype=np.float64))
+        
+        offsets = np.zeros(len(deltas) + 1, dtype=int)
+        np.cumsum([len(delta) for delta in deltas], out=offsets[1:])
+        
+        return cls(x, y, z, alpha,
+                   np.concatenate(deltas) if deltas else np.empty(0),
+                   offsets)
+    
+    
+    def __len__(self):
+        
+        return len(self.x)
+    
+    
+    def __getitem__(self, key):
+        
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('History only supports contiguous slices')
+            stop = max(start, stop)
+            return History(self.x[start:stop], self.y[start:stop],
+                           self.z[start:stop], self.alpha[start:stop],
+                           self.deltas, self.offsets[start:stop+1])
+        
+        i = range(len(self))[key]
+        
+        return (int(self.x[i]), int(self.y[i]), int(self.z[i]),
+                float(self.alpha[i]),
+                self.deltas[self.offsets[i]:self.offsets[i+1]])
+    
+    
+    def __iter__(self):
+        
+        offsets = self.offsets.tolist()
+        
+        for x, y, z, alpha, start, end in zip(self.x.tolist(),
+                                              self.y.tolist(),
+                                              self.z.tolist(),
+                                              self.alpha.tolist(),
+                                              offsets[:-1], offsets[1:]):
+            yield x, y, z, alpha, self.deltas[start:end]
+    
+    
+    def __repr__(self):
+        
+        return repr(list(self))
+    
+    
+    def __getstate__(self):
+        
+        # only the used part of the (possibly shared) delta buffer
+        start, end = self.offsets[0], self.offsets[-1]
+        
+        return {'x': self.x, 'y': self.y, 'z': self.z, 'alpha': self.alpha,
+                'deltas': self.deltas[start:end],
+                'offsets': self.offsets - start}
+    
+    
+    def __setstate__(self, state):
+        
+        self.__dict__.update(state)
+    
+    
+    def to_list(self):
+        """The history as a list of tuples (x, y, z, alpha, delta)."""
+        
+        return list(self)
@@ -1,12 +1,40 @@
 # -*- coding: utf-8 -*-
 
+from collections import Counter
+import io
+
+import numpy as np
+
 from erdbeermet.visualize.RecognitionVis import Visualizer
-from erdbeermet.tools.FileIO import write_recognition
+from erdbeermet.tools.Condensed import to_condensed, to_matrix
+from erdbeermet.tools.FileIO import (write_recognition,
+                                     write_recognition_binary,
+                                     read_recognition_binary)
 
 
 __author__ = 'David Schaller'
 
 
+# reasons why a recognition path failed, stored as integer codes in the nodes
+INFO_STRINGS = ['', 'no pseudometric', 'negative delta/dxy', 'no candidate',
+                'spikes too short', 'transposition']
+
+_INFO_CODES = {info: code for code, info in enumerate(INFO_STRINGS)}
+
+
+def info_code(info):
+    """Integer code of an info string (new strings are registered)."""
+    
+    code = _INFO_CODES.get(info)
+    
+    if code is None:
+        code = len(INFO_STRINGS)
+        INFO_STRINGS.append(info)
+        _INFO_CODES[info] = code
+    
+    return code
+
+
 class TreeNode:
     """Tree node class for type R matrix recognition tree.
     
@@ -16,6 +44,14 @@ class TreeNode:
     distance matrix, and every other node corresponds the remaining distance
     matrix after the application of a specific R-step (x, y: z)alpha.
     
+    To keep large trees small, the nodes use __slots__, the info string is
+    stored as an integer code, and the item list and the distance matrix need
+    not be stored. Non-root nodes derive V from the parent's V and the R-step,
+    and rebuild D from the closest ancestor that stores its matrix by
+    repeating the R-steps (with the stored deltas) on the way down. If the
+    root stores a condensed vector (see tools.Condensed), so do all nodes;
+    D is always returned as a square matrix.
+    
     Attributes
     ----------
     n : int
@@ -23,30 +59,40 @@ class TreeNode:
     V : list
         List of items after removal of z.
     D : 2-dimensional numpy array
-        Distance matrix after removal of z and update of the distances.
+        Distance matrix after removal of z and update of the distances. None
+        if the R-step was not carried out (negative deltas).
     R_step : tuple
         x, y, z, and alpha representing the R-step (x, y: z)alpha that was
         applied last.
+    deltas : tuple
+        delta_x and delta_y of the R-step that was applied last, or None if
+        the R-step was not carried out.
     valid_ways : int
         Total number of recognition paths leading to a success in the subtree
         below this node.
     info : str
         Info string why the recognition failed after the application of
         this R-step (if this is the case).
+    info_code : int
+        Index of the info string in INFO_STRINGS.
     """
     
-    def __init__(self, n, V, D=None, R_step=None):
+    __slots__ = ('parent', 'children', 'n', '_V', '_D', 'R_step', 'deltas',
+                 'valid_ways', 'info_code')
+    
+    def __init__(self, n, V=None, D=None, R_step=None, deltas=None):
         
         self.parent = None
-        self.children = []
+        self.children = ()          # list once a child is added
         
         self.n = n
-        self.V = V
-        self.D = D
+        self._V = V
+        self._D = D
         self.R_step = R_step
+        self.deltas = deltas
         
         self.valid_ways = 0
-        self.info = ''
+        self.info_code = 0
         
         
     def __str__(self):
@@ -57,14 +103,171 @@ class TreeNode:
             token += '|({},{}:{}){:.4f}'.format(*self.R_step)
         
         return token + '>>'
+    
+    
+    @property
+    def info(self):
+        
+        return INFO_STRINGS[self.info_code]
+    
+    
+    @info.setter
+    def info(self, info):
+        
+        self.info_code = info_code(info)
+    
+    
+    @property
+    def V(self):
+        
+        # collect the removed items up to the closest node that stores V
+        removed = set()
+        v = self
+        while v._V is None:
+            removed.add(v.R_step[2])
+            v = v.parent
+        
+        if not removed:
+            return v._V
+        
+        return [item for item in v._V if item not in removed]
+    
+    
+    @V.setter
+    def V(self, V):
+        
+        self._V = V
+    
+    
+    @property
+    def D(self):
+        
+        # collect the R-steps up to the closest node that stores D
+        path = []
+        v = self
+        while v._D is None:
+            if v.deltas is None or v.parent is None:
+                return None
+            path.append(v)
+            v = v.parent
+        
+        D = v._D
+        if D.ndim == 1:
+            D = to_matrix(D, dtype=np.float64)
+        
+        if not path:
+            return D
+        
+        # import here since the recognition module depends on this module
+        from erdbeermet.recognition import _matrix_without_index, _update_matrix
+        
+        V = v.V
+        for w in reversed(path):
+            x, y, z, _ = w.R_step
+            D = _matrix_without_index(D, V.index(z))
+            V = [item for item in V if item != z]
+            _update_matrix(V, D, x, y, *w.deltas)
+        
+        return D
+    
+    
+    @D.setter
+    def D(self, D):
+        
+        # use the format of the closest ancestor that stores its matrix
+        if D is not None and D.ndim == 2:
+            v = self.parent
+            while v is not None and v._D is None:
+                v = v.parent
+            if v is not None and v._D.ndim == 1:
+                D = to_condensed(D)
+        
+        self._D = D
+    
+    
+    def stores_matrix(self):
+        """Whether the matrix is stored (instead of rebuilt on access)."""
+        
+        return self._D is not None
         
         
     def add_child(self, child):
+        """Attach a child; the children are kept sorted by their R-steps."""
         
-        self.children.append(child)
+        if not self.children:
+            self.children = []
+        
+        # insertion behind all children with smaller or equal R-step
+        i = len(self.children)
+        if child.R_step is not None:
+            while i and self.children[i-1].R_step > child.R_step:
+                i -= 1
+        self.children.insert(i, child)
         child.parent = self
         
 
+def _preorder(node, inner_only=False):
+    # iterative preorder with an explicit stack (recognition trees can be
+    # too deep for recursion); if inner_only, leaves are skipped
+    
+    stack = [node] if node else []
+    while stack:
+        v = stack.pop()
+        if inner_only and not v.children:
+            continue
+        yield v
+        stack.extend(reversed(v.children))
+
+
+_COMMA = object()
+
+
+class _Closing:
+    # marks the end of the children of a node in Tree.write_newick()
+    
+    __slots__ = ('node',)
+    
+    def __init__(self, node):
+        
+        self.node = node
+        
+
+def _load_nodes(arrays, meta, codes, start, end):
+    # the nodes start, ..., end-1 of a tree in the binary format, linked to
+    # their parents if these are in the range
+    
+    columns = {name: array[start:end].tolist() for name, array in
+               arrays.items() if name not in ('matrices', 'matrix_offsets')}
+    offsets = arrays['matrix_offsets'][start:end+1].tolist()
+    nodes = []
+    
+    for i in range(end - start):
+        
+        parent = columns['parent'][i]
+        v = TreeNode(columns['n'][i], V=meta['V'] if parent == -1 else None)
+        if parent != -1:
+            v.R_step = (columns['x'][i], columns['y'][i], columns['z'][i],
+                        columns['alpha'][i])
+        if not np.isnan(columns['delta_x'][i]):
+            v.deltas = (columns['delta_x'][i], columns['delta_y'][i])
+        v.valid_ways = columns['valid_ways'][i]
+        v.info_code = codes.get(columns['info_code'][i], 0)
+        
+        if offsets[i+1] > offsets[i]:
+            d = arrays['matrices'][offsets[i]:offsets[i+1]]
+            v._D = d if meta['condensed'] else to_matrix(d, dtype=np.float64)
+        
+        if start <= parent:
+            p = nodes[parent - start]
+            if not p.children:
+                p.children = []
+            p.children.append(v)
+            v.parent = p
+        nodes.append(v)
+    
+    return nodes
+
+
 class Tree:
     """Tree for type R matrix recognition.
     
@@ -76,6 +279,19 @@ class Tree:
     ----------
     root : TreeNode
         The root corresponds to the full distance matrix.
+    valid_ways : int
+        Total number of recognition paths leading to a success (set by the
+        recognition).
+    successes : int
+        Same as valid_ways.
+    failures : collections.Counter
+        Number of nodes per info string, i.e., per reason why the recognition
+        failed at a node. Set by the recognition.
+    reused : int
+        Number of subproblems reused from the transposition table (see
+        recognition.recognize()); the reused nodes with valid ways have the
+        info 'transposition' but are not counted as failures. Set by the
+        recognition.
     """
     
     def __init__(self, root):
@@ -83,99 +299,106 @@ class Tree:
         self.root = root
     
     
-    def preorder(self):
-        """Generator for preorder traversal of the tree."""
-        
-        def _preorder(node):
-            yield node
-            for child in node.children:
-                yield from _preorder(child)
+    def preorder(self, node=None):
+        """Generator for preorder traversal of the tree (or of the subtree
+        rooted at node)."""
         
-        if self.root:
-            yield from _preorder(self.root)
-        else:
-            yield from []
+        yield from _preorder(node or self.root)
     
     
-    def postorder(self):
-        """Generator for postorder traversal of the tree."""
+    def postorder(self, node=None):
+        """Generator for postorder traversal of the tree (or of the subtree
+        rooted at node)."""
         
-        def _postorder(node):
-            for child in node.children:
-                yield from _postorder(child)
-            yield node
+        node = node or self.root
         
-        if self.root:
-            yield from _postorder(self.root)
-        else:
-            yield from []
-            
+        # explicit stack of (node, iterator over its remaining children)
+        stack = [(node, iter(node.children))] if node else []
+        while stack:
+            v, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                yield v
+            else:
+                stack.append((child, iter(child.children)))
+    
     
     def inner_vertices(self):
         """Generator for inner vertices in preorder."""
         
-        def _inner_vertices(node):
-            if node.children:
-                yield node
-                for child in node.children:
-                    yield from _inner_vertices(child)
-        
-        if self.root:
-            yield from _inner_vertices(self.root)
-        else:
-            yield from []
-            
+        yield from _preorder(self.root, inner_only=True)
+    
     
     def edges(self):
         """Generator for all edges of the tree."""
         
-        def _edges(node):
-            for child in node.children:
-                yield (node, child)
-                yield from _edges(child)
-        
-        if self.root:
-            yield from _edges(self.root)
-        else:
-            yield from []
-            
+        for v in _preorder(self.root):
+            if v is not self.root:
+                yield (v.parent, v)
+    
     
     def inner_edges(self):
         """Generator for all inner edges of the tree."""
         
-        def _inner_edges(node):
-            for child in node.children:
-                if child.children:
-                    yield (node, child)
-                    yield from _inner_edges(child)
-        
-        if self.root:
-            yield from _inner_edges(self.root)
-        else:
-            yield from []
-
-
+        for v in _preorder(self.root, inner_only=True):
+            if v is not self.root:
+                yield (v.parent, v)
+    
+    
     def to_newick(self, node=None):
-        """Recursive Tree --> Newick (str) function."""
+        """Tree (or the subtree rooted at node) --> Newick (str) function."""
         
-        def _to_newick(node):
-            if not node.children:
-                return str(node)
-            else:
-                s = ''
-                for child in node.children:
-                    s += _to_newick(child) + ','
-                return "({}){}".format(s[:-1], node)
+        f = io.StringIO()
+        self.write_newick(f, node=node)
         
-        if self.root:
-            return _to_newick(self.root) + ';'
-        else:
-            return ';'
+        return f.getvalue()
+    
+    
+    def write_newick(self, f, node=None, buffer_size=2**16):
+        """Write the tree (or the subtree rooted at node) in Newick format
+        into a file object f.
         
+        The string is written in parts of about buffer_size tokens, i.e.,
+        it is never built as a whole.
+        """
+        
+        node = node or self.root
+        parts = []
+        
+        # explicit stack of nodes to open, closing nodes and commas
+        stack = [node] if node else []
+        while stack:
+            v = stack.pop()
+            if v is _COMMA:
+                parts.append(',')
+            elif isinstance(v, _Closing):
+                parts.append(')' + str(v.node))
+            elif v.children:
+                parts.append('(')
+                stack.append(_Closing(v))
+                for i in range(len(v.children) - 1, -1, -1):
+                    stack.append(v.children[i])
+                    if i:
+                        stack.append(_COMMA)
+            else:
+                parts.append(str(v))
+            
+            if len(parts) >= buffer_size:
+                f.write(''.join(parts))
+                parts.clear()
+        
+        parts.append(';')
+        f.write(''.join(parts))
+    
     
-    def visualize(self, decimal_prec=4, save_as=None, popup=True):
+    def visualize(self, decimal_prec=4, save_as=None, popup=True,
+                  max_depth=None, max_nodes=1000):
+        """Draw the tree (large trees are collapsed, see
+        visualize.RecognitionVis.Visualizer)."""
         
-        Visualizer(self, decimal_prec=decimal_prec, save_as=save_as, popup=popup)
+        Visualizer(self, decimal_prec=decimal_prec, save_as=save_as, popup=popup,
+                   max_depth=max_depth, max_nodes=max_nodes)
     
     
     def write_to_file(self, filename):
@@ -183,6 +406,89 @@ class Tree:
         write_recognition(filename, self)
     
     
+    def save(self, filename, matrices=True):
+        """Write the tree in the binary format (see tools.FileIO), which can
+        be read with Tree.load().
+        
+        Parameters
+        ----------
+        filename : str
+            Path and filename.
+        matrices : bool, optional
+            If True, the stored matrices of the nodes are written as well.
+            The default is True.
+        """
+        
+        write_recognition_binary(filename, self, matrices=matrices)
+    
+    
+    @staticmethod
+    def load(filename, node=0, mmap=True):
+        """Read a tree (or one of its subtrees) written by Tree.save().
+        
+        Only the nodes of the subtree are read (they are contiguous in the
+        file), as well as the path to it from the root if the root of the
+        subtree does not store its matrix itself.
+        
+        Parameters
+        ----------
+        filename : str
+            Path and filename.
+        node : int, optional
+            Preorder index of the root of the subtree to be loaded. The
+            default is 0, i.e., the whole tree.
+        mmap : bool, optional
+            If True, the file is memory-mapped, and condensed matrices remain
+            views of the file until they are accessed. The default is True.
+        
+        Returns
+        -------
+        Tree
+            The tree with the attributes 'valid_ways', 'successes', and
+            'failures' of the subtree.
+        """
+        
+        arrays, meta = read_recognition_binary(filename, mmap=mmap)
+        
+        start = node
+        end = start + int(arrays['size'][start])
+        codes = {code: info_code(info)
+                 for code, info in meta['info_strings'].items()}
+        
+        nodes = _load_nodes(arrays, meta, codes, start, end)
+        root = nodes[0]
+        
+        # V and D of the subtree root from the path to the root of the file
+        if start:
+            path = []
+            i = start
+            while i != -1:
+                path.append(i)
+                i = int(arrays['parent'][i])
+            chain = [_load_nodes(arrays, meta, codes, i, i + 1)[0]
+                     for i in reversed(path[1:])]
+            for parent, child in zip(chain, chain[1:] + [root]):
+                child.parent = parent
+            V, D = root.V, root.D
+            root.parent = None
+            root.V = V
+            if not root.stores_matrix() and D is not None:
+                root._D = to_condensed(D) if meta['condensed'] else D
+        
+        tree = Tree(root)
+        tree.valid_ways = root.valid_ways
+        tree.successes = root.valid_ways
+        tree.failures = Counter()
+        # the nodes with an info but without valid ways are the failures
+        infos = arrays['info_code'][start:end]
+        counts = np.bincount(infos[arrays['valid_ways'][start:end] == 0])
+        for code, count in enumerate(counts.tolist()):
+            if code and count:
+                tree.failures[INFO_STRINGS[codes[code]]] = count
+        
+        return tree
+    
+    
     def _assert_integrity(self):
         
         for v in self.preorder():
@@ -4,28 +4,24 @@ import numpy as np
 from scipy.linalg import solve
 import matplotlib.pyplot as plt
 
+from erdbeermet.tools.Condensed import to_condensed
 
-def plot_box_graph(distances, labels=None):
+
+def plot_box_graph(distances, labels=None, save_as=None, popup=True):
     
     box = Box4(distances, labels=labels)
-    box.plot()
+    box.plot(save_as=save_as, popup=popup)
     
     return box
 
 
-def distance_vector_from_matrix(matrix):
+def distance_vector_from_matrix(matrix, out=None):
     
-    dim = matrix.shape[0]
-    length = dim * (dim-1) // 2
+    # row by row, so that the matrix (and out) may be memory-mapped
+    if matrix.ndim == 1:
+        return matrix
     
-    b = np.zeros((length,))
-    counter = 0
-    for i in range(dim-1):
-        for j in range(i+1, dim):
-            b[counter] = matrix[i, j]
-            counter += 1
-            
-    return b
+    return to_condensed(matrix, dtype=np.float64, out=out)
 
           
 def distance_sums(b):
@@ -159,7 +155,7 @@ class Box4:
             return False
     
     
-    def plot(self):
+    def plot(self, save_as=None, popup=True):
         
         if self._diagonal_mode is None:
             return
@@ -223,7 +219,11 @@ class Box4:
         ax.set_aspect('equal')
         plt.axis('off')
         plt.tight_layout()
-        plt.show()
+        
+        if save_as:
+            plt.savefig(save_as)
+        if popup:
+            plt.show()
 
 
     @staticmethod
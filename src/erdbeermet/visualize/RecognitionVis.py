@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 
+from collections import Counter
+import heapq
+import math
+
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
+from matplotlib.collections import LineCollection, PatchCollection
 
 from matplotlib import rc
 rc('font',**{'family':'sans-serif','sans-serif':['Helvetica']})
@@ -12,16 +17,46 @@ __author__ = 'David Schaller'
 
 
 class Visualizer:
+    """Drawing of a recognition tree.
+    
+    The edges and the node symbols are drawn as one LineCollection and one
+    PatchCollection, respectively. To keep the drawing of large trees
+    bounded, only the nodes within a node budget are drawn: the nodes are
+    expanded in the order successful subtrees first, then by depth, and a
+    node is drawn as a summary glyph (with the number of nodes and the
+    failure reasons below it) instead of its subtree if the subtree failed
+    and lies deeper than max_depth, or if its children exceed the budget.
+    
+    Parameters
+    ----------
+    tree : Tree
+        The recognition tree.
+    decimal_prec : int, optional
+        Number of decimal places of the alphas. The default is 4.
+    save_as : str, optional
+        Filename to save the figure. The default is None.
+    popup : bool, optional
+        Show the figure. The default is True.
+    max_depth : int, optional
+        Failed subtrees below this depth are collapsed. The default is None,
+        i.e., no limit.
+    max_nodes : int, optional
+        Maximal number of drawn nodes. The default is 1000; None means no
+        limit.
+    """
     
     info_dict = {'no pseodometric': r'no pseodometric',
                  'negative delta/dxy': r'negative $\delta$/$d_{xy}$',
                  'no candidate': r'no candidate',
                  'spikes too short': r'spikes too short'}
     
-    def __init__(self, tree, decimal_prec=4, save_as=None, popup=True):
+    def __init__(self, tree, decimal_prec=4, save_as=None, popup=True,
+                 max_depth=None, max_nodes=1000):
         
         self.tree = tree
         self.decimal_prec = decimal_prec
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
         
         self.edge_length = 0.5
         self.symbolsize = 0.03
@@ -36,6 +71,8 @@ class Visualizer:
         self.colors = {}
         self.leaf_counter = 0
         self.node_positions = {}
+        self.expanded = set()
+        self.collapsed = []
         
         self.popup = popup
         
@@ -51,6 +88,7 @@ class Visualizer:
         self.ax.set_aspect('equal')
         self.ax.invert_yaxis()
         
+        self.select_nodes()
         self.initial_traversal()
         self.assign_positions()
         self.draw_edges()
@@ -72,11 +110,66 @@ class Visualizer:
             plt.show()
         
     
+    def select_nodes(self):
+        """Choose the nodes whose children are drawn (within the budget)."""
+        
+        root = self.tree.root
+        count = 1
+        counter = 0
+        heap = [(0, 0, counter, root)]
+        
+        while heap:
+            _, depth, _, v = heapq.heappop(heap)
+            if not v.children:
+                continue
+            
+            if ((not v.valid_ways and self.max_depth is not None
+                 and depth >= self.max_depth) or
+                (self.max_nodes is not None
+                 and count + len(v.children) > self.max_nodes)):
+                self.collapsed.append(v)
+                continue
+            
+            self.expanded.add(v)
+            count += len(v.children)
+            for child in v.children:
+                counter += 1
+                heapq.heappush(heap, (0 if child.valid_ways else 1,
+                                      depth + 1, counter, child))
+    
+    
+    def children(self, v):
+        
+        return v.children if v in self.expanded else ()
+    
+    
+    def preorder(self):
+        
+        stack = [self.tree.root]
+        while stack:
+            v = stack.pop()
+            yield v
+            stack.extend(reversed(self.children(v)))
+    
+    
+    def postorder(self):
+        
+        stack = [(self.tree.root, iter(self.children(self.tree.root)))]
+        while stack:
+            v, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                yield v
+            else:
+                stack.append((child, iter(self.children(child))))
+        
+    
     def initial_traversal(self):
         
         xmax = 0.0
         
-        for v in self.tree.preorder():
+        for v in self.preorder():
             if not v.parent:
                 self.distance_dict[v] = self.edge_length
             else:
@@ -84,8 +177,8 @@ class Visualizer:
                                          self.edge_length)
                 if self.distance_dict[v] > xmax:
                     xmax = self.distance_dict[v]
-
-            if not v.children:
+            
+            if not self.children(v):
                 self.leaf_counter += 1
                 
         self.ax.set_xlim(-0.1,xmax+0.5)
@@ -97,72 +190,121 @@ class Visualizer:
         self.ax.set_ylim(ymax+self.symbolsize*0.6, -self.symbolsize*0.6)
         
         yposition = 0
-        for v in self.tree.postorder():
-            if not v.children:
+        for v in self.postorder():
+            children = self.children(v)
+            if not children:
                 self.node_positions[v] = (self.distance_dict[v],
                                           yposition)
                 yposition += 1/self.leafs_per_vertical_unit
             else:
-                ymean = (self.node_positions[v.children[0]][1] +
-                         self.node_positions[v.children[-1]][1])/2
+                ymean = (self.node_positions[children[0]][1] +
+                         self.node_positions[children[-1]][1])/2
                 self.node_positions[v] = (self.distance_dict[v],
                                           ymean)
     
     
     def draw_edges(self):
         
-        for v in self.tree.preorder():
+        segments = []
+        
+        for v in self.preorder():
+            x, y = self.node_positions[v]
             if v.parent:
-                self.ax.plot([self.node_positions[v.parent][0],
-                              self.node_positions[v][0]],
-                             [self.node_positions[v][1],
-                              self.node_positions[v][1]],
-                     color='black',
-                     linestyle='-', linewidth=1)
+                segments.append([(self.node_positions[v.parent][0], y),
+                                 (x, y)])
             else:
-                self.ax.plot([self.node_positions[v][0]-self.edge_length,
-                              self.node_positions[v][0]],
-                             [self.node_positions[v][1],
-                              self.node_positions[v][1]],
-                     color='black',
-                     linestyle='-', linewidth=1)
-            if v.children:
-                self.ax.plot([self.node_positions[v][0],
-                              self.node_positions[v][0]],
-                             [self.node_positions[v.children[0]][1],
-                              self.node_positions[v.children[-1]][1]],
-                     color='black',
-                     linestyle='-', linewidth=1)
+                segments.append([(x-self.edge_length, y), (x, y)])
+            children = self.children(v)
+            if children:
+                segments.append([(x, self.node_positions[children[0]][1]),
+                                 (x, self.node_positions[children[-1]][1])])
+        
+        self.ax.add_collection(LineCollection(segments, colors='black',
+                                              linestyles='-', linewidths=1))
     
     
     def draw_nodes(self):
         
-        for v in self.tree.preorder():
+        circles, colors = [], []
+        
+        for v in self.preorder():
             
             x, y = self.node_positions[v]
             
-            color = 'red'
-            if v.valid_ways:
-                color = 'lightgreen'
-            
-            self.draw_circle(x, y, color=color)
+            circles.append(mpatches.Circle((x, y), self.symbolsize/2))
+            colors.append('lightgreen' if v.valid_ways else 'red')
             self.write_V_and_R_step(v)
             
             if not v.children:
                 self.write_abort_info(v)
-                
+        
+        self.ax.add_collection(PatchCollection(
+            circles, facecolors=colors, edgecolors='black',
+            linewidths=self.symbolsize/self.symbollw,
+            zorder=self.symbol_zorder))
+        
+        self.draw_summaries()
     
-    def draw_circle(self, x, y, color='white'):
-        
-        fill = mpatches.Circle((x, y), self.symbolsize/2,
-                               color=color, fill=True,
-                               zorder=self.symbol_zorder)
-        self.ax.add_patch(fill)
-        outer = mpatches.Circle((x, y), self.symbolsize/2,
-                                color='black', fill=False,
-                                lw=self.symbolsize/self.symbollw,
-                                zorder=self.symbol_zorder)
-        self.ax.add_patch(outer)
+    
+    def collapsed_counts(self):
+        """Number of nodes and failures (per reason) below each collapsed
+        node, computed in one bottom-up pass over the tree."""
+        
+        collapsed = set(self.collapsed)
+        pending = {}        # counts of the nodes whose parent is not yet done
+        counts = {}
+        
+        for v in self.tree.postorder():
+            
+            size, failures = 0, Counter()
+            for child in v.children:
+                child_size, child_failures = pending.pop(child)
+                size += child_size
+                failures.update(child_failures)
+            
+            if v in collapsed:
+                counts[v] = (size, failures.copy())
+            
+            # failed nodes, i.e., with info but without valid ways
+            if v.info_code and not v.valid_ways:
+                failures[v.info] += 1
+            pending[v] = (size + 1, failures)
+        
+        return counts
+    
+    
+    def draw_summaries(self):
+        """Summary glyphs for the collapsed subtrees."""
+        
+        glyphs, colors = [], []
+        counts = self.collapsed_counts()
+        
+        for v in self.collapsed:
+            
+            x, y = self.node_positions[v]
+            size, failures = counts[v]
+            
+            glyphs.append(mpatches.RegularPolygon(
+                (x+self.symbolsize/2+0.03, y), 3, radius=self.symbolsize/2,
+                orientation=-math.pi/2))        # pointing right
+            colors.append('lightgreen' if v.valid_ways else 'red')
+            
+            text = f'+{size} nodes'
+            if v.valid_ways:
+                text += f', {v.valid_ways} valid ways'
+            if failures:
+                text += ' (' + ', '.join(f'{info}: {count}' for info, count
+                                         in failures.most_common()) + ')'
+            self.ax.text(x+self.symbolsize+0.05, y, text,
+                         horizontalalignment='left',
+                         verticalalignment='center',
+                         fontsize=self.fs)
+        
+        if glyphs:
+            self.ax.add_collection(PatchCollection(
+                glyphs, facecolors=colors, edgecolors='black',
+                linewidths=self.symbolsize/self.symbollw,
+                zorder=self.symbol_zorder))
     
     
     def write_V_and_R_step(self, v):
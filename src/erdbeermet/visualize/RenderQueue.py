@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""Rendering of recognition trees and box graphs in worker processes.
+
+Matplotlib is slow for large figures. A RenderQueue hands the rendering jobs
+to a pool of worker processes that use the non-interactive Agg backend, so
+that the submitting process (e.g., a simulation pipeline) only enqueues the
+jobs and never waits for Matplotlib. Recognition trees are passed as files
+written by Tree.save(), box graphs as their (small) distance matrices.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+
+__author__ = 'David Schaller'
+
+
+def _init_worker():
+    
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+def _render_tree(tree_file, save_as, kwargs):
+    
+    import matplotlib.pyplot as plt
+    from erdbeermet.tools.Tree import Tree
+    from erdbeermet.visualize.RecognitionVis import Visualizer
+    
+    visualizer = Visualizer(Tree.load(tree_file), save_as=save_as,
+                            popup=False, **kwargs)
+    plt.close(visualizer.fig)
+    
+    return save_as
+
+
+def _render_box_graph(distances, labels, save_as):
+    
+    import matplotlib.pyplot as plt
+    from erdbeermet.visualize.BoxGraphVis import plot_box_graph
+    
+    plot_box_graph(distances, labels=labels, save_as=save_as, popup=False)
+    plt.close('all')
+    
+    return save_as
+
+
+class RenderQueue:
+    """Queue of rendering jobs that are processed by worker processes.
+    
+    The submit methods return immediately. Failed jobs do not raise in the
+    submitting process; they are collected in the attribute 'failed'. Use
+    close() (or the queue as a context manager) to wait for the remaining
+    jobs at the end.
+    
+    Parameters
+    ----------
+    workers : int, optional
+        Number of worker processes. The default is None, in which case the
+        number of CPUs is used.
+    
+    Attributes
+    ----------
+    submitted : int
+        Number of submitted jobs.
+    done : int
+        Number of successfully finished jobs.
+    failed : list of tuples
+        The output filenames and the exceptions of the failed jobs.
+    """
+    
+    def __init__(self, workers=None):
+        
+        self.submitted = 0
+        self.done = 0
+        self.failed = []
+        
+        # the workers switch to Agg (also if they inherit another backend)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context(),
+            initializer=_init_worker)
+    
+    
+    def __enter__(self):
+        
+        return self
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        
+        self.close()
+    
+    
+    def submit_tree(self, tree_file, save_as, **kwargs):
+        """Render a recognition tree saved with Tree.save().
+        
+        Parameters
+        ----------
+        tree_file : str
+            File written by Tree.save(); it must not be removed before the
+            job has finished.
+        save_as : str
+            Output file, e.g., a PDF or SVG file.
+        kwargs
+            Further arguments of visualize.RecognitionVis.Visualizer, e.g.,
+            decimal_prec, max_depth, or max_nodes.
+        """
+        
+        self._submit(_render_tree, save_as, tree_file, save_as, kwargs)
+    
+    
+    def submit_box_graph(self, distances, save_as, labels=None):
+        """Render the box graph of a metric on 4 items.
+        
+        Parameters
+        ----------
+        distances : numpy array
+            A 4 x 4 distance matrix or its condensed vector.
+        save_as : str
+            Output file, e.g., a PDF or SVG file.
+        labels : list, optional
+            Labels of the 4 items. The default is None.
+        """
+        
+        self._submit(_render_box_graph, save_as, distances,
+                     list(labels) if labels is not None else None, save_as)
+    
+    
+    def close(self):
+        """Wait for the remaining jobs and shut down the workers."""
+        
+        self._executor.shutdown(wait=True)
+    
+    
+    def _submit(self, function, save_as, *args):
+        
+        self.submitted += 1
+        future = self._executor.submit(function, *args)
+        future.add_done_callback(lambda f: self._finished(f, save_as))
+    
+    
+    def _finished(self, future, save_as):
+        
+        if future.cancelled():
+            return
+        
+        exception = future.exception()
+        if exception is None:
+            self.done += 1
+        else:
+            self.failed.append((save_as, exception))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import warnings
+
+import numpy as np
+import pytest
+
+from erdbeermet.simulation import simulate
+import erdbeermet.tools.FileIO as FileIO
+from erdbeermet.tools.FileIO import parse_history, write_history
+
+
+def test_parse_history(tmp_path):
+    
+    scenario = simulate(8, branching_prob=0.3)
+    filename = tmp_path / 'history'
+    write_history(filename, scenario.history)
+    
+    history = parse_history(filename)
+    
+    assert len(history) == len(scenario.history)
+    for event, expected in zip(history, scenario.history):
+        assert event[:4] == tuple(expected[:4])
+        assert np.array_equal(event[4], expected[4])
+
+
+@pytest.mark.parametrize('delta', ['0.1,x', '0.1,,0.2', '0.1'])
+def test_parse_history_malformed_delta(tmp_path, delta):
+    
+    filename = tmp_path / 'history'
+    filename.write_text(f'(0, 0: 1) 1.0; [0.1,0.2]\n(0, 1: 2) 0.5; [{delta}]\n')
+    
+    with pytest.raises(ValueError, match='line 2'):
+        parse_history(filename)
+
+
+def test_parse_history_malformed_delta_warning(tmp_path, monkeypatch):
+    
+    # numpy 1.x only warns (DeprecationWarning) about unparsable data
+    def fromstring(string, dtype=float, sep=''):
+        warnings.warn('string or file could not be read to its end',
+                      DeprecationWarning)
+        return np.array([0.1])
+    
+    monkeypatch.setattr(FileIO.np, 'fromstring', fromstring)
+    filename = tmp_path / 'history'
+    filename.write_text('(0, 0: 1) 1.0; [0.1,x]\n')
+    
+    with pytest.raises(ValueError, match='line 1'):
+        parse_history(filename)
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from erdbeermet.simulation import simulate_batch, scenario_from_seed
+
+
+@pytest.mark.parametrize('N', [6, 40, 200])
+@pytest.mark.parametrize('dtype', [None, np.float32])
+def test_batch_from_seed(N, dtype):
+    
+    D, histories, seed = simulate_batch(3, N, branching_prob=0.2, seed=7,
+                                        dtype=dtype)
+    
+    for i in range(3):
+        scenario = scenario_from_seed(seed, i, N, branching_prob=0.2,
+                                      dtype=dtype)
+        assert scenario.D.dtype == D.dtype
+        assert np.array_equal(scenario.D, D[i])